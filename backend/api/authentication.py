@@ -0,0 +1,198 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import profiling
+
+TOKEN_CACHE_PREFIX = "auth-token:"
+USER_VERSION_PREFIX = "auth-user-version:"
+# Поля пользователя, которых нет в кэше: хеш пароля не покидает базу,
+# last_login и счетчики меняются без сброса версии. У пользователя из
+# кэша они отложены и читаются из базы при обращении, а save() их не
+# перезаписывает.
+UNCACHED_FIELDS = {
+    "password",
+    "last_login",
+    "followers_count",
+    "recipes_count",
+}
+# Кэши, которые не видят другие процессы: отзыв токена в них не дойдет
+# до остальных воркеров gunicorn
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+User = get_user_model()
+
+
+def get_shared_cache():
+    """Общий кэш токенов или None, если TOKEN_AUTH_CACHE пуст или
+    указывает на кэш процесса: тогда токены всегда читаются из базы"""
+    alias = settings.TOKEN_AUTH_CACHE
+    if not alias:
+        return None
+    shared = caches[alias]
+    if isinstance(shared, PROCESS_LOCAL_CACHES):
+        return None
+    return shared
+
+
+def get_shared_key(key):
+    return TOKEN_CACHE_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_version_key(user_id):
+    return f"{USER_VERSION_PREFIX}{user_id}"
+
+
+def get_user_version(shared, user_id):
+    """Версия пользователя в общем кэше. Записи его токенов с другой
+    версией недействительны."""
+    key = get_version_key(user_id)
+    version = shared.get(key)
+    if version is not None:
+        return version
+    shared.add(key, uuid.uuid4().hex, None)
+    return shared.get(key)
+
+
+class LocalTokenCache:
+    """Токены процесса: LRU на TOKEN_AUTH_CACHE_SIZE записей, каждая
+    живет TOKEN_AUTH_CACHE_TIMEOUT секунд. Запись - тройка (id
+    пользователя, версия пользователя, поля пользователя)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + settings.TOKEN_AUTH_CACHE_TIMEOUT
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalTokenCache()
+
+
+def invalidate_user(user_id):
+    """Сбрасывает закэшированные токены пользователя во всех процессах:
+    смена пароля, деактивация, правка профиля"""
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.set(get_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def invalidate(key, user_id):
+    """Забывает токен при выходе или удалении. Версия пользователя
+    меняется, чтобы токен забыли и локальные кэши других процессов."""
+    local_cache.discard(key)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete(get_shared_key(key))
+    invalidate_user(user_id)
+
+
+def get_user_fields(user):
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in User._meta.concrete_fields
+        if field.attname not in UNCACHED_FIELDS
+    }
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запросов к базе на попадании в кэш.
+
+    По ключу токена кэшируются поля пользователя с версией этого
+    пользователя: сначала в LRU кэше процесса, затем в общем кэше
+    TOKEN_AUTH_CACHE. На каждый запрос из общего кэша читается только
+    версия пользователя, пользователь перечитывается из базы после ее
+    смены. Без общего кэша работает как обычный TokenAuthentication.
+    Попадания и промахи видны в метриках как api_token_cache_*_total.
+    """
+
+    def authenticate_credentials(self, key):
+        shared = get_shared_cache()
+        if shared is None:
+            return super().authenticate_credentials(key)
+
+        shared_key = get_shared_key(key)
+        user_id = None
+        entry = local_cache.get(key)
+        if entry is not None:
+            user_id, version, fields = entry
+            if shared.get(get_version_key(user_id)) == version:
+                profiling.increment("token_cache_local_hits")
+                return self.get_result(key, fields)
+            local_cache.discard(key)
+
+        entry = shared.get(shared_key)
+        if entry is not None:
+            user_id, version, fields = entry
+            if shared.get(get_version_key(user_id)) == version:
+                profiling.increment("token_cache_shared_hits")
+                local_cache.set(key, entry)
+                return self.get_result(key, fields)
+
+        profiling.increment("token_cache_misses")
+        if user_id is None:
+            # Владелец токена не меняется, но версию нужно прочитать до
+            # пользователя: иначе сброс между чтениями сохранит старые
+            # поля под новой версией
+            user_id = (
+                Token.objects.filter(key=key)
+                .values_list("user_id", flat=True)
+                .first()
+            )
+            if user_id is None:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+        version = get_user_version(shared, user_id)
+        user, token = super().authenticate_credentials(key)
+        entry = (user.pk, version, get_user_fields(user))
+        local_cache.set(key, entry)
+        shared.set(shared_key, entry, settings.TOKEN_AUTH_CACHE_TIMEOUT)
+        return user, token
+
+    def get_result(self, key, fields):
+        if not fields["is_active"]:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        user = User.from_db(
+            router.db_for_read(User), list(fields), list(fields.values())
+        )
+        return user, Token(key=key, user=user)
@@ -0,0 +1,93 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+
+TAG_PREFIX = "api-cache-tag:"
+ENTRY_PREFIX = "api-cache:"
+# Счетчик версий тегов: каждая инвалидация берет следующее значение
+CLOCK_KEY = "api-cache-clock"
+
+
+def get_cache():
+    return caches["api"]
+
+
+def make_key(request, name):
+    """Ключ из пути и отсортированных параметров запроса"""
+    params = sorted(
+        (key, sorted(values)) for key, values in request.GET.lists()
+    )
+    raw = f"{name}:{request.get_host()}{request.path}:{params}"
+    return ENTRY_PREFIX + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get_clock():
+    """Текущее значение счетчика. Вытесненный счетчик начинается заново
+    с текущего времени в наносекундах, то есть больше любой выданной
+    версии."""
+    cache = get_cache()
+    clock = cache.get(CLOCK_KEY)
+    if clock is not None:
+        return clock
+    cache.add(CLOCK_KEY, time.time_ns(), None)
+    return cache.get(CLOCK_KEY)
+
+
+def get_tag_versions(tags):
+    """Текущие версии тегов. Отсутствующие получают текущее значение
+    счетчика, поэтому вытеснение тега после инвалидации делает старые
+    записи недействительными."""
+    cache = get_cache()
+    keys = {TAG_PREFIX + tag: tag for tag in tags}
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        clock = get_clock()
+        for key in missing:
+            # add, а не set: не затирать инвалидацию из другого запроса
+            cache.add(key, clock, None)
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def invalidate(*tags):
+    cache = get_cache()
+    try:
+        version = cache.incr(CLOCK_KEY)
+    except ValueError:
+        get_clock()
+        version = cache.incr(CLOCK_KEY)
+    cache.set_many({TAG_PREFIX + tag: version for tag in tags}, None)
+
+
+def get_entry(key):
+    entry = get_cache().get(key)
+    if entry is None:
+        return None
+    if get_tag_versions(entry["tags"]) != entry["tags"]:
+        return None
+    return entry["data"]
+
+
+def set_entry(key, data, tags, clock):
+    """Сохраняет ответ, посчитанный после чтения счетчика clock. Если
+    какой-то из тегов инвалидирован позже, ответ мог собраться из
+    старых данных и не кэшируется."""
+    versions = get_tag_versions(tags)
+    if any(version > clock for version in versions.values()):
+        return
+    get_cache().set(key, {"data": data, "tags": versions})
+
+
+def get_recipe_tags(recipe_data):
+    """Теги инвалидации для сериализованного рецепта"""
+    tags = {f"recipe:{recipe_data['id']}"}
+    if "author" in recipe_data:
+        tags.add(f"user:{recipe_data['author']['id']}")
+    tags.update(f"tag:{tag['id']}" for tag in recipe_data.get("tags", ()))
+    tags.update(
+        f"ingredient:{ingredient['id']}"
+        for ingredient in recipe_data.get("ingredients", ())
+    )
+    return tags
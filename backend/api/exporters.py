@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ExportQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Слишком много выгрузок, повторите позже"
+    default_code = "export_queue_full"
+
+
+class ShoppingCartExporter:
+    """Базовый класс формата выгрузки списка покупок"""
+
+    format = None
+    extension = None
+    content_type = None
+
+    def render(self, ingredients):
+        """Принимает строки (название, ед. измерения, количество),
+        возвращает содержимое файла в байтах."""
+        raise NotImplementedError
+
+
+class TextExporter(ShoppingCartExporter):
+    format = "txt"
+    extension = "txt"
+    content_type = "text/plain; charset=utf-8"
+
+    def render(self, ingredients):
+        return "".join(
+            f"{name} ({measurement_unit}) — {amount}\n"
+            for name, measurement_unit, amount in ingredients
+        ).encode()
+
+
+class CsvExporter(ShoppingCartExporter):
+    format = "csv"
+    extension = "csv"
+    content_type = "text/csv; charset=utf-8"
+
+    def render(self, ingredients):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["Ингредиент", "Ед. измерения", "Количество"])
+        writer.writerows(ingredients)
+        # BOM нужен, чтобы Excel распознал кириллицу
+        return buffer.getvalue().encode("utf-8-sig")
+
+
+class PdfExporter(ShoppingCartExporter):
+    format = "pdf"
+    extension = "pdf"
+    content_type = "application/pdf"
+
+    font_name = "ShoppingCartFont"
+    font_size = 12
+    margin = 50
+
+    def render(self, ingredients):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfgen import canvas
+
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT)
+            )
+
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+
+        pdf.setFont(self.font_name, self.font_size * 1.5)
+        pdf.drawString(self.margin, height - self.margin, "Список покупок")
+        y = height - self.margin - line_height * 2
+        pdf.setFont(self.font_name, self.font_size)
+
+        for name, measurement_unit, amount in ingredients:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y, f"{name} ({measurement_unit}) — {amount}"
+            )
+            y -= line_height
+
+        pdf.save()
+        return buffer.getvalue()
+
+
+EXPORTERS = {}
+
+
+def register_exporter(exporter_class):
+    EXPORTERS[exporter_class.format] = exporter_class()
+    return exporter_class
+
+
+for _exporter in (TextExporter, CsvExporter, PdfExporter):
+    register_exporter(_exporter)
+
+
+def get_exporter(file_format):
+    return EXPORTERS.get(file_format)
+
+
+def get_cache_key(exporter, ingredients):
+    """Ключ зависит только от формата и содержимого корзины"""
+    digest = hashlib.sha256(exporter.format.encode())
+    for row in ingredients:
+        digest.update(repr(row).encode())
+    return f"shopping-cart:{digest.hexdigest()}"
+
+
+def render(file_format, ingredients):
+    """Точка входа процесса пула: экспортеры не передаются между
+    процессами, формат ищется в реестре заново"""
+    return get_exporter(file_format).render(ingredients)
+
+
+class RenderPool:
+    """Пул процессов для больших выгрузок.
+
+    Рендеринг CSV и PDF - чистый Python под GIL, поэтому он вынесен
+    в отдельные процессы: поток запроса ждет результат, не занимая
+    интерпретатор воркера. Очередь ограничена
+    SHOPPING_CART_EXPORT_QUEUE_SIZE задачами, сверх нее запрос получает
+    503. Процессы запускаются через spawn при первой выгрузке, уже после
+    fork воркера gunicorn.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.SHOPPING_CART_EXPORT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._slots = threading.BoundedSemaphore(
+                    settings.SHOPPING_CART_EXPORT_QUEUE_SIZE
+                )
+            return self._executor
+
+    def render(self, exporter, ingredients):
+        executor = self.get_executor()
+        if not self._slots.acquire(blocking=False):
+            raise ExportQueueFull()
+        try:
+            return executor.submit(
+                render, exporter.format, ingredients
+            ).result()
+        finally:
+            self._slots.release()
+
+
+render_pool = RenderPool()
+
+
+def export(exporter, ingredients):
+    """Отдает файл из кэша, а если его там нет - рендерит и кэширует.
+    Большие выгрузки рендерятся в пуле процессов."""
+    cache_key = get_cache_key(exporter, ingredients)
+    content = cache.get(cache_key)
+    if content is not None:
+        return content
+
+    if (
+        settings.SHOPPING_CART_EXPORT_WORKERS
+        and len(ingredients) >= settings.SHOPPING_CART_EXPORT_POOL_THRESHOLD
+    ):
+        content = render_pool.render(exporter, ingredients)
+    else:
+        content = exporter.render(ingredients)
+
+    cache.set(cache_key, content, settings.SHOPPING_CART_EXPORT_CACHE_TTL)
+    return content
@@ -1,16 +1,51 @@
+from django import forms
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as df_filters
 from rest_framework import filters
 
-from recipes import models
+from recipes import models, search
+
+TAG_SLUGS_CACHE_KEY = "tag-slug-ids"
+# Кэш по умолчанию у каждого процесса свой, сброс при изменении тегов
+# доходит только до одного из них, остальные ждут истечения срока
+TAG_SLUGS_CACHE_TIMEOUT = 5 * 60
+
+
+def get_tag_ids(slugs):
+    """id тегов по слагам из закэшированного словаря слаг -> id, None
+    для неизвестных слагов. Если слага нет в кэше, словарь
+    перечитывается из базы: тег мог появиться после кэширования."""
+    slug_ids = cache.get(TAG_SLUGS_CACHE_KEY)
+    if slug_ids is None or not set(slugs) <= slug_ids.keys():
+        slug_ids = dict(models.Tag.objects.values_list("slug", "id"))
+        cache.set(TAG_SLUGS_CACHE_KEY, slug_ids, TAG_SLUGS_CACHE_TIMEOUT)
+    return [slug_ids.get(slug) for slug in slugs]
+
+
+def invalidate_tag_ids():
+    cache.delete(TAG_SLUGS_CACHE_KEY)
+
+
+class SlugMultipleField(forms.MultipleChoiceField):
+    """Список слагов без проверки по заранее заданным вариантам"""
+
+    def valid_value(self, value):
+        return True
+
+
+class SlugMultipleFilter(df_filters.MultipleChoiceFilter):
+    field_class = SlugMultipleField
 
 
 class RecipeFilter(df_filters.FilterSet):
-    tags = df_filters.ModelMultipleChoiceFilter(
-        field_name="tags__slug",
-        to_field_name="slug",
-        queryset=models.Tag.objects.all(),
+    tags = SlugMultipleFilter(method="filter_tags")
+    tags_match = df_filters.ChoiceFilter(
+        choices=[("any", "any"), ("all", "all")], method="filter_noop"
     )
 
+    search = df_filters.CharFilter(method="filter_search")
+
     is_favorited = df_filters.CharFilter(method="filter_is_favorited")
 
     is_in_shopping_cart = df_filters.CharFilter(
@@ -21,6 +56,42 @@ class RecipeFilter(df_filters.FilterSet):
         model = models.Recipe
         fields = ["tags", "author"]
 
+    def filter_tags(self, queryset, name, value):
+        """Полусоединение по id тегов вместо JOIN по слагам, строки
+        рецептов не размножаются и DISTINCT не нужен."""
+        if not value:
+            return queryset
+
+        tag_ids = get_tag_ids(set(value))
+        match_all = self.form.cleaned_data.get("tags_match") == "all"
+        if match_all and None in tag_ids:
+            # Рецептов с несуществующим тегом нет
+            return queryset.none()
+        tag_ids = [tag_id for tag_id in tag_ids if tag_id is not None]
+        if not tag_ids:
+            return queryset.none()
+
+        recipe_tags = models.Recipe.tags.through.objects.filter(
+            recipe=OuterRef("pk")
+        )
+        if match_all:
+            for tag_id in tag_ids:
+                queryset = queryset.filter(
+                    Exists(recipe_tags.filter(tag_id=tag_id))
+                )
+            return queryset
+        return queryset.filter(Exists(recipe_tags.filter(tag_id__in=tag_ids)))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам,
+        результаты сортируются по релевантности"""
+        if not value.strip():
+            return queryset
+        return search.search(queryset, value)
+
+    def filter_noop(self, queryset, name, value):
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         if value == "1":
             return queryset.filter(favorite_recipes__user=self.request.user)
@@ -34,3 +105,22 @@ class RecipeFilter(df_filters.FilterSet):
 
 class CustomSearchFilter(filters.SearchFilter):
     search_param = "name"
+
+
+class StableOrderingFilter(filters.OrderingFilter):
+    """Дописывает к сортировке cursor_ordering view, чтобы рецепты
+    с одинаковыми счетчиками не перескакивали между страницами"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if (
+            "search_rank" in queryset.query.annotations
+            and self.ordering_param not in request.query_params
+        ):
+            ordering.insert(0, "-search_rank")
+        fields = {name.lstrip("-") for name in ordering}
+        return ordering + [
+            name
+            for name in getattr(view, "cursor_ordering", [])
+            if name.lstrip("-") not in fields
+        ]
@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import models
+
+User = get_user_model()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "orange").save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет основные эндпоинты API через тестовый клиент и выводит "
+        "p50/p99 задержки и число SQL запросов. Все изменения в базе "
+        "откатываются, картинки пишутся во временный каталог."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=30)
+        parser.add_argument(
+            "--user", help="email пользователя, от имени которого запросы"
+        )
+        parser.add_argument(
+            "--only", action="append", help="Запустить только эти сценарии"
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Вывести результат в JSON"
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        self.tag_slugs = list(
+            models.Tag.objects.values_list("slug", flat=True)[:2]
+        )
+        self.ingredient_ids = list(
+            models.Ingredient.objects.values_list("id", flat=True)[:10]
+        )
+        if not self.ingredient_ids or not self.tag_slugs:
+            raise CommandError("Нет тегов или ингредиентов")
+        self.image = make_image()
+
+        setup_test_environment()
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root):
+                    with transaction.atomic():
+                        results = self.run(user, options)
+                        transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_table(results)
+
+    def get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f"Пользователь {email} не найден")
+
+        user = (
+            User.objects.annotate(activity=Count("subscribers"))
+            .order_by("-activity", "id")
+            .first()
+        )
+        if user is None:
+            raise CommandError(
+                "Нет пользователей, см. generate_synthetic_data"
+            )
+        return user
+
+    def scenarios(self):
+        tags = "&".join(f"tags={slug}" for slug in self.tag_slugs)
+        return {
+            "recipes_list": lambda i: (
+                "get",
+                f"/api/recipes/?page={i % 5 + 1}",
+            ),
+            "recipes_list_anonymous": lambda i: (
+                "anonymous",
+                f"/api/recipes/?page={i % 5 + 1}",
+            ),
+            "recipes_list_tags": lambda i: ("get", f"/api/recipes/?{tags}"),
+            "recipes_list_favorited": lambda i: (
+                "get",
+                "/api/recipes/?is_favorited=1",
+            ),
+            "recipes_list_cart": lambda i: (
+                "get",
+                "/api/recipes/?is_in_shopping_cart=1",
+            ),
+            "recipe_create": lambda i: ("post", "/api/recipes/"),
+            "recipe_update": lambda i: ("patch", "/api/recipes/{id}/"),
+            "download_shopping_cart": lambda i: (
+                "get",
+                "/api/recipes/download_shopping_cart/",
+            ),
+            "subscriptions": lambda i: (
+                "get",
+                "/api/users/subscriptions/?recipes_limit=3",
+            ),
+            "recipe_match": lambda i: (
+                "get",
+                "/api/recipes/match/?ingredients="
+                + ",".join(map(str, self.ingredient_ids[: i % 5 + 2])),
+            ),
+            "ingredient_search": lambda i: (
+                "anonymous",
+                "/api/ingredients/?name=" + "соль"[: i % 4 + 1],
+            ),
+        }
+
+    def recipe_data(self, iteration):
+        count = iteration % len(self.ingredient_ids) + 1
+        return {
+            "name": f"Бенчмарк {iteration}",
+            "text": "Рецепт из бенчмарка",
+            "cooking_time": 10,
+            "image": self.image,
+            "tags": list(
+                models.Tag.objects.filter(
+                    slug__in=self.tag_slugs
+                ).values_list("id", flat=True)
+            ),
+            "ingredients": [
+                {"id": ingredient_id, "amount": iteration + 1}
+                for ingredient_id in self.ingredient_ids[:count]
+            ],
+        }
+
+    def run(self, user, options):
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        anonymous = APIClient()
+        created_id = None
+        results = {}
+
+        for name, scenario in self.scenarios().items():
+            if options["only"] and name not in options["only"]:
+                continue
+
+            timings, queries = [], []
+            for iteration in range(options["iterations"]):
+                method, url = scenario(iteration)
+                kwargs = {}
+                if method in ("post", "patch"):
+                    kwargs = {
+                        "data": self.recipe_data(iteration),
+                        "format": "json",
+                    }
+                if method == "patch":
+                    if created_id is None:
+                        created_id = self.create_recipe(client)
+                    url = url.format(id=created_id)
+
+                requester = anonymous if method == "anonymous" else client
+                method = "get" if method == "anonymous" else method
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = getattr(requester, method)(url, **kwargs)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f"{name}: {url} вернул {response.status_code}"
+                    )
+                queries.append(len(context.captured_queries))
+
+            results[name] = {
+                "p50_ms": round(statistics.median(timings), 2),
+                "p99_ms": round(percentile(timings, 0.99), 2),
+                "queries_median": statistics.median(queries),
+                "queries_max": max(queries),
+            }
+        return results
+
+    def create_recipe(self, client):
+        response = client.post(
+            "/api/recipes/", self.recipe_data(0), format="json"
+        )
+        if response.status_code != 201:
+            raise CommandError(f"Не удалось создать рецепт: {response.data}")
+        return response.data["id"]
+
+    def print_table(self, results):
+        self.stdout.write(
+            f"{'сценарий':<26}{'p50, мс':>10}{'p99, мс':>10}"
+            f"{'запросы':>10}{'макс':>8}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<26}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                f"{result['queries_median']:>10}{result['queries_max']:>8}"
+            )
@@ -0,0 +1,108 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework import renderers
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from api.management.commands.benchmark_serialization import percentile
+from api.renderers import JSONRenderer, orjson
+from api.serializers import RecipeSerializer
+from recipes import models
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет процессорное время кодирования страниц списка рецептов "
+        "в JSON: JSONRenderer DRF против api.renderers.JSONRenderer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=50)
+        parser.add_argument(
+            "--page-size", type=int, default=api_settings.PAGE_SIZE
+        )
+        parser.add_argument(
+            "--fields", help="Поля через запятую, по умолчанию все"
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by("id").first()
+        if user is None:
+            raise CommandError("Пользователь не найден")
+        request = Request(APIRequestFactory().get("/api/recipes/"))
+        request.user = user
+        fields = options["fields"].split(",") if options["fields"] else None
+        size = options["page_size"]
+        recipes = list(
+            models.Recipe.objects.with_relations()
+            .with_user_flags(user)
+            .order_by("-create_date", "-id")[: options["pages"] * size]
+        )
+        if not recipes:
+            raise CommandError("Нет рецептов, см. generate_synthetic_data")
+
+        setup_test_environment()
+        try:
+            # Та же форма, что у ответа RecipeViewSet.list
+            payloads = [
+                {
+                    "count": len(recipes),
+                    "next": "http://testserver/api/recipes/?cursor=cD0y",
+                    "previous": None,
+                    "results": RecipeSerializer(
+                        recipes[start:start + size],
+                        many=True,
+                        fields=fields,
+                        context={"request": request},
+                    ).data,
+                }
+                for start in range(0, len(recipes), size)
+            ]
+        finally:
+            teardown_test_environment()
+
+        baseline = renderers.JSONRenderer()
+        renderer = JSONRenderer()
+        for payload in payloads:
+            if baseline.render(payload) != renderer.render(payload):
+                raise CommandError("Вывод отличается от JSONRenderer DRF")
+
+        results = {
+            "drf": self.measure(baseline.render, payloads),
+            "orjson" if orjson else "fallback": self.measure(
+                renderer.render, payloads
+            ),
+            "stream": self.measure(
+                lambda payload: b"".join(renderer.iter_render(payload)),
+                payloads,
+            ),
+        }
+        self.stdout.write(
+            f"{'рендерер':<18}{'p50, мс':>10}{'p99, мс':>10}{'среднее':>10}"
+        )
+        for name, timings in results.items():
+            self.stdout.write(
+                f"{name:<18}{statistics.median(timings):>10.3f}"
+                f"{percentile(timings, 0.99):>10.3f}"
+                f"{statistics.mean(timings):>10.3f}"
+            )
+
+    def measure(self, render, payloads, repeat=20):
+        """Процессорное время кодирования страницы, мс"""
+        timings = []
+        for payload in payloads:
+            start = time.process_time()
+            for _ in range(repeat):
+                render(payload)
+            timings.append((time.process_time() - start) * 1000 / repeat)
+        return timings
@@ -0,0 +1,125 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from api import snapshots
+from api.serializers import RecipeSerializer
+from recipes import models
+
+User = get_user_model()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет процессорное время сериализации страницы рецептов: "
+        "полная сериализация, снимки при пустом кэше и из кэша"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=50)
+        parser.add_argument(
+            "--page-size", type=int, default=api_settings.PAGE_SIZE
+        )
+        parser.add_argument(
+            "--user", help="email пользователя, от имени которого запросы"
+        )
+        parser.add_argument(
+            "--fields", help="Поля через запятую, по умолчанию все"
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        request = Request(APIRequestFactory().get("/api/recipes/"))
+        request.user = user
+        fields = options["fields"].split(",") if options["fields"] else None
+        size = options["page_size"]
+        pages = [
+            list(
+                models.Recipe.objects.values_list("pk", flat=True)[
+                    start:start + size
+                ]
+            )
+            for start in range(0, options["pages"] * size, size)
+        ]
+        pages = [page for page in pages if page]
+        if not pages:
+            raise CommandError("Нет рецептов, см. generate_synthetic_data")
+
+        full = models.Recipe.objects.with_relations().with_user_flags(user)
+        rows = models.Recipe.objects.with_user_flags(user).only(
+            *snapshots.ROW_FIELDS
+        )
+        # Отдельный кэш, чтобы не сбрасывать рабочие снимки
+        caches = dict(settings.CACHES)
+        caches["benchmark"] = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "benchmark-snapshots",
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        }
+        setup_test_environment()
+        try:
+            with override_settings(
+                CACHES=caches, RECIPE_SNAPSHOT_CACHE="benchmark"
+            ):
+                results = {
+                    "full": self.measure(
+                        full, pages, request, fields, False
+                    ),
+                    "snapshots_cold": self.measure(
+                        rows, pages, request, fields, True
+                    ),
+                    "snapshots_warm": self.measure(
+                        rows, pages, request, fields, True
+                    ),
+                }
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'режим':<18}{'p50, мс':>10}{'p99, мс':>10}{'среднее':>10}"
+        )
+        for name, timings in results.items():
+            self.stdout.write(
+                f"{name:<18}{statistics.median(timings):>10.2f}"
+                f"{percentile(timings, 0.99):>10.2f}"
+                f"{statistics.mean(timings):>10.2f}"
+            )
+
+    def get_user(self, email):
+        users = User.objects.all()
+        if email:
+            users = users.filter(email=email)
+        user = users.order_by("id").first()
+        if user is None:
+            raise CommandError("Пользователь не найден")
+        return user
+
+    def measure(self, queryset, pages, request, fields, use_snapshots):
+        """Процессорное время на страницу, мс. Запрос страницы к базе
+        выполняется до замера."""
+        context = {"request": request, "snapshots": use_snapshots}
+        timings = []
+        for page in pages:
+            recipes = list(queryset.filter(pk__in=page))
+            start = time.process_time()
+            RecipeSerializer(
+                recipes, many=True, fields=fields, context=context
+            ).data
+            timings.append((time.process_time() - start) * 1000)
+        return timings
@@ -1,4 +1,18 @@
-from rest_framework import mixins, viewsets
+from calendar import timegm
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import mixins, status, viewsets
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from . import cache, serializers
+from .renderers import JSONRenderer
+from recipes import services
 
 
 class CreateDeleteViewSet(
@@ -11,3 +25,348 @@ class GetViewSet(
     mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
 ):
     pass
+
+
+class BulkRelationMixin:
+    """Пакетное добавление и удаление связей текущего пользователя
+    с рецептами или авторами: POST и DELETE с телом {"ids": [...]}.
+
+    Существование объектов и уже созданные связи проверяются одним
+    запросом, новые связи добавляются одним bulk_create, а удаляются
+    одним DELETE. Ответ содержит результат для каждого id. Зависимые
+    данные (счетчики, списки покупок, ленты) вьюсет обновляет в
+    on_bulk_created и on_bulk_deleted.
+
+    Результат считается по состоянию, прочитанному под lock_user, поэтому
+    одиночные добавление и удаление связей вьюсета тоже должны брать
+    lock_user, иначе параллельная вставка будет посчитана дважды.
+    """
+
+    target_model = None
+    relation_model = None
+    owner_field = "user"
+    target_field = "recipe"
+    exists_message = "Связь уже есть"
+    missing_message = "Связи нет"
+    not_found_message = "Объект не найден"
+
+    def get_bulk_ids(self, request):
+        serializer = serializers.BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data["ids"]))
+
+    def get_relations(self, **lookup):
+        return self.relation_model.objects.filter(
+            **{self.owner_field: self.request.user}, **lookup
+        )
+
+    def get_bulk_state(self, ids):
+        """{id объекта: есть ли связь} для найденных объектов"""
+        linked = self.get_relations(**{self.target_field: OuterRef("pk")})
+        return dict(
+            self.target_model.objects.filter(pk__in=ids)
+            .annotate(linked=Exists(linked))
+            .values_list("pk", "linked")
+        )
+
+    def validate_bulk_target(self, target_id):
+        """Сообщение об ошибке, если связь с объектом создать нельзя"""
+
+    def on_bulk_created(self, ids):
+        pass
+
+    def on_bulk_deleted(self, ids):
+        pass
+
+    @staticmethod
+    def get_result(target_id, result, detail=None):
+        if detail is None:
+            return {"id": target_id, "status": result}
+        return {"id": target_id, "status": result, "detail": detail}
+
+    def bulk_create(self, request, *args, **kwargs):
+        ids = self.get_bulk_ids(request)
+        results = []
+        created = []
+        with transaction.atomic():
+            services.lock_user(request.user)
+            state = self.get_bulk_state(ids)
+            for target_id in ids:
+                if target_id not in state:
+                    results.append(
+                        self.get_result(
+                            target_id, "not_found", self.not_found_message
+                        )
+                    )
+                elif state[target_id]:
+                    results.append(
+                        self.get_result(
+                            target_id, "exists", self.exists_message
+                        )
+                    )
+                else:
+                    error = self.validate_bulk_target(target_id)
+                    if error:
+                        results.append(
+                            self.get_result(target_id, "invalid", error)
+                        )
+                        continue
+                    created.append(target_id)
+                    results.append(self.get_result(target_id, "created"))
+
+            self.relation_model.objects.bulk_create(
+                (
+                    self.relation_model(
+                        **{
+                            self.owner_field: request.user,
+                            f"{self.target_field}_id": target_id,
+                        }
+                    )
+                    for target_id in created
+                ),
+                ignore_conflicts=True,
+            )
+            if created:
+                self.on_bulk_created(created)
+        return Response({"results": results})
+
+    def bulk_delete(self, request, *args, **kwargs):
+        ids = self.get_bulk_ids(request)
+        results = []
+        deleted = []
+        with transaction.atomic():
+            services.lock_user(request.user)
+            state = self.get_bulk_state(ids)
+            for target_id in ids:
+                if target_id not in state:
+                    results.append(
+                        self.get_result(
+                            target_id, "not_found", self.not_found_message
+                        )
+                    )
+                elif not state[target_id]:
+                    results.append(
+                        self.get_result(
+                            target_id, "missing", self.missing_message
+                        )
+                    )
+                else:
+                    deleted.append(target_id)
+                    results.append(self.get_result(target_id, "deleted"))
+
+            if deleted:
+                self.get_relations(
+                    **{f"{self.target_field}__in": deleted}
+                ).delete()
+                self.on_bulk_deleted(deleted)
+        return Response({"results": results})
+
+
+class SparseFieldsetMixin:
+    """Выбор полей ответа параметрами ?fields=a,b и ?omit=c.
+
+    Без ?fields= action из card_actions отдает card_fields. Сериализатор
+    должен поддерживать fields и omit
+    (api.serializers.SparseFieldsSerializerMixin), queryset читает только
+    колонки выбранных полей.
+    """
+
+    fields_param = "fields"
+    omit_param = "omit"
+    card_fields = None
+    card_actions = ("list",)
+
+    def get_param_list(self, name):
+        values = [
+            value.strip()
+            for values in self.request.query_params.getlist(name)
+            for value in values.split(",")
+        ]
+        return [value for value in values if value] or None
+
+    def get_field_selection(self):
+        if self.request.method not in SAFE_METHODS:
+            return None, None
+        fields = self.get_param_list(self.fields_param)
+        if fields is None and self.action in self.card_actions:
+            fields = self.card_fields
+        return fields, self.get_param_list(self.omit_param)
+
+    def get_serializer(self, *args, **kwargs):
+        fields, omit = self.get_field_selection()
+        kwargs.setdefault("fields", fields)
+        kwargs.setdefault("omit", omit)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_selected_fields(self):
+        """Имена выбранных полей сериализатора или None, если нужны все"""
+        if self.get_field_selection() == (None, None):
+            return None
+        return set(self.get_serializer().fields)
+
+    def get_model_fields(self):
+        """Колонки для only(): поля сериализатора и ключ курсора"""
+        return self.get_serializer().get_model_fields() + [
+            name.lstrip("-") for name in getattr(self, "cursor_ordering", [])
+        ]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.get_selected_fields() is None:
+            return queryset
+        return queryset.only(*self.get_model_fields())
+
+
+class AnonymousCacheMixin:
+    """Кэширует list и retrieve для анонимных пользователей.
+
+    Вьюсет должен реализовать get_cache_tags(data, many), по тегам
+    записи сбрасываются сигналами из api.signals.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            "list", super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            "retrieve", super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, name, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+
+        key = cache.make_key(request, f"{self.basename}.{name}")
+        data = cache.get_entry(key)
+        if data is not None:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        # Счетчик версий читается до обработки запроса: инвалидация во
+        # время обработки не даст сохранить устаревший ответ
+        clock = cache.get_clock()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set_entry(
+                key,
+                response.data,
+                self.get_cache_tags(response.data, name),
+                clock,
+            )
+        response["X-Cache"] = "MISS"
+        return response
+
+
+def count_items(data):
+    """Число элементов списка или списка results страницы"""
+    if isinstance(data, dict):
+        data = data.get("results")
+    return len(data) if isinstance(data, list) else 0
+
+
+class StreamingJSONMixin:
+    """Большие списки отдаются StreamingHttpResponse: JSON кодируется
+    пачками во время отправки, а не целиком в памяти.
+
+    Mixin должен стоять первым, чтобы заголовки других mixin уже были
+    в ответе, который он заменяет.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        renderer = getattr(response, "accepted_renderer", None)
+        if (
+            response.status_code != status.HTTP_200_OK
+            or not isinstance(response, Response)
+            or not isinstance(renderer, JSONRenderer)
+            or not renderer.is_compact(
+                response.accepted_media_type, response.renderer_context
+            )
+            or count_items(response.data)
+            < settings.API_JSON_STREAM_MIN_ITEMS
+        ):
+            return response
+
+        streaming = StreamingHttpResponse(
+            renderer.iter_render(response.data),
+            status=response.status_code,
+            content_type=response.accepted_media_type,
+        )
+        for header, value in response.items():
+            # Content-Type у еще не отрисованного Response - по умолчанию
+            if header != "Content-Type":
+                streaming[header] = value
+        return streaming
+
+
+class NotModified(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def get_collection_validators(queryset):
+    """ETag и дата изменения коллекции одним агрегирующим запросом"""
+    stats = queryset.aggregate(count=Count("pk"), modified=Max("updated_at"))
+    modified = stats["modified"]
+    timestamp = modified.timestamp() if modified else 0
+    etag = quote_etag(
+        f"{queryset.model._meta.model_name}-{stats['count']}-{timestamp}"
+    )
+    return etag, modified
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на If-None-Match/If-Modified-Since до сериализации.
+
+    Вьюсет реализует get_validators(), возвращающий (etag, last_modified)
+    для текущего action или (None, None), если проверка не нужна.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = (None, None)
+        if request.method not in ("GET", "HEAD"):
+            return
+
+        self.validators = self.get_validators()
+        etag, last_modified = self.validators
+        if etag is None and last_modified is None:
+            return
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=(
+                timegm(last_modified.utctimetuple()) if last_modified else None
+            ),
+        )
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        etag, last_modified = getattr(self, "validators", (None, None))
+        if response.status_code in (
+            status.HTTP_200_OK,
+            status.HTTP_304_NOT_MODIFIED,
+        ):
+            if etag:
+                response["ETag"] = etag
+            if last_modified:
+                response["Last-Modified"] = http_date(
+                    timegm(last_modified.utctimetuple())
+                )
+        patch_vary_headers(response, ["Authorization"])
+        return response
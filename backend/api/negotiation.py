@@ -0,0 +1,8 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """Параметр ?format= задает формат файла, а не рендерер DRF"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
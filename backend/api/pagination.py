@@ -1,5 +1,17 @@
+import json
+from base64 import urlsafe_b64decode as b64decode
+from base64 import urlsafe_b64encode as b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.models import Recipe
 
 
 class OnlyDataPagination(pagination.PageNumberPagination):
@@ -11,3 +23,176 @@ class OnlyDataPagination(pagination.PageNumberPagination):
 
 class LimitPagination(pagination.PageNumberPagination):
     page_size_query_param = "limit"
+
+
+class KeysetPagination(pagination.BasePagination):
+    """Курсорная пагинация по ключу сортировки без OFFSET и COUNT.
+
+    Курсор хранит значения полей сортировки последней записи, следующая
+    страница выбирается условием (create_date, id) < (значения курсора),
+    которое покрывается составным индексом.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ("-pk",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, "cursor_ordering", self.ordering)
+        meta = queryset.model._meta
+        self.fields = [
+            meta.pk if name.lstrip("-") == "pk" else meta.get_field(name)
+            for name in (name.lstrip("-") for name in self.ordering)
+        ]
+        self.check_ordering(queryset)
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(name) for name in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(position, reverse))
+
+        return self.get_page(
+            list(queryset[: page_size + 1]), page_size, position, reverse
+        )
+
+    def check_ordering(self, queryset):
+        """Курсор хранит только поля cursor_ordering, поэтому другая
+        сортировка (?ordering=, релевантность ?search=) с ним
+        несовместима"""
+        order_by = list(queryset.query.order_by)
+        if order_by and order_by != list(self.ordering):
+            raise ValidationError(
+                {
+                    self.cursor_query_param: (
+                        "Курсор работает только с сортировкой по "
+                        "умолчанию, без ordering и search"
+                    )
+                }
+            )
+
+    def get_page(self, results, page_size, position, reverse):
+        """Обрезает лишнюю запись и запоминает позиции соседних страниц"""
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if has_more if reverse else position is not None:
+                self.previous_position = self.get_position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_link(self.next_position, False)),
+                    ("previous", self.get_link(self.previous_position, True)),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    @staticmethod
+    def invert(name):
+        return name[1:] if name.startswith("-") else "-" + name
+
+    def get_position(self, instance):
+        return [field.value_to_string(instance) for field in self.fields]
+
+    def get_seek_filter(self, position, reverse):
+        """(a, b) < (x, y) раскрывается в a < x OR (a = x AND b < y)"""
+        seek = Q()
+        equal = Q()
+        for name, field, value in zip(self.ordering, self.fields, position):
+            descending = name.startswith("-") != reverse
+            lookup = "lt" if descending else "gt"
+            seek |= equal & Q(**{f"{field.attname}__{lookup}": value})
+            equal &= Q(**{field.attname: value})
+        return seek
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(b64decode(encoded.encode()).decode())
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.fields, payload["p"])
+            ]
+            reverse = bool(payload["r"])
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound("Неверный курсор")
+        if len(position) != len(self.fields):
+            raise NotFound("Неверный курсор")
+        return position, reverse
+
+    def get_link(self, position, reverse):
+        if position is None:
+            return None
+        cursor = b64encode(
+            json.dumps({"p": position, "r": int(reverse)}).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты подписок.
+
+    Вместо queryset принимает recipes.feed.Feed, который сам сливает
+    потоки рецептов. Курсор тот же, что у рецептов: (create_date, id).
+    """
+
+    ordering = ("-create_date", "-id")
+
+    def paginate_queryset(self, feed, request, view=None):
+        self.request = request
+        meta = Recipe._meta
+        self.fields = [meta.get_field("create_date"), meta.pk]
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        return self.get_page(
+            feed.read(page_size + 1, position, reverse),
+            page_size,
+            position,
+            reverse,
+        )
+
+
+class LimitOrKeysetPagination(LimitPagination):
+    """Постраничная пагинация, а при ?cursor= — курсорная"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,184 @@
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger("api.profiling")
+
+_current = contextvars.ContextVar("api_profiling_stats", default=None)
+_lock = threading.Lock()
+_views = defaultdict(Counter)
+_counters = Counter()
+
+IN_CLAUSE = re.compile(r"\((?:%s, )*%s\)")
+
+
+def increment(name, value=1):
+    """Счетчик, который попадет в метрики как api_<name>_total"""
+    with _lock:
+        _counters[name] += value
+
+
+class RequestStats:
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.in_serializer = False
+        self.fingerprints = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[IN_CLAUSE.sub("(...)", sql)] += 1
+
+    @property
+    def duplicate_queries(self):
+        return sum(
+            count - 1 for count in self.fingerprints.values() if count > 1
+        )
+
+
+def _timed_data(original):
+    def data(self):
+        stats = _current.get()
+        if stats is None or stats.in_serializer:
+            return original.fget(self)
+
+        stats.in_serializer = True
+        start = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            stats.serializer_time += time.perf_counter() - start
+            stats.in_serializer = False
+
+    return property(data)
+
+
+class ProfilingMiddleware:
+    """Замеряет время ответа, SQL запросы и сериализацию по view.
+
+    Включается настройкой API_PROFILING, иначе Django сразу выкидывает
+    middleware из цепочки. В DEBUG режиме цифры отдаются заголовками
+    ответа, в остальных случаях копятся для MetricsView и пишутся в лог,
+    если запрос медленный или похож на N+1.
+    """
+
+    _serializers_patched = False
+
+    def __init__(self, get_response):
+        if not settings.API_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+        if not ProfilingMiddleware._serializers_patched:
+            BaseSerializer.data = _timed_data(BaseSerializer.data)
+            ProfilingMiddleware._serializers_patched = True
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats.execute):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+
+        if stats.view is not None:
+            self.record(request, response, stats, elapsed)
+        if settings.DEBUG:
+            self.add_headers(response, stats, elapsed)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current.get()
+        if stats is None:
+            return
+
+        view_class = getattr(view_func, "cls", None)
+        if view_class is None:
+            stats.view = getattr(view_func, "__name__", "unknown")
+            return
+
+        actions = getattr(view_func, "actions", None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        stats.view = f"{view_class.__name__}.{action}"
+
+    def record(self, request, response, stats, elapsed):
+        with _lock:
+            metrics = _views[stats.view]
+            metrics["requests"] += 1
+            metrics["seconds"] += elapsed
+            metrics["db_queries"] += stats.queries
+            metrics["db_seconds"] += stats.db_time
+            metrics["serializer_seconds"] += stats.serializer_time
+            metrics["duplicate_queries"] += stats.duplicate_queries
+
+        slow = elapsed * 1000 >= settings.API_PROFILING_SLOW_MS
+        if slow or stats.duplicate_queries:
+            logger.warning(
+                "%s %s %s status=%s time=%.1fms queries=%d db=%.1fms "
+                "serializer=%.1fms duplicates=%d",
+                stats.view,
+                request.method,
+                request.path,
+                response.status_code,
+                elapsed * 1000,
+                stats.queries,
+                stats.db_time * 1000,
+                stats.serializer_time * 1000,
+                stats.duplicate_queries,
+            )
+
+    def add_headers(self, response, stats, elapsed):
+        response["X-DB-Queries"] = stats.queries
+        response["X-Duplicate-Queries"] = stats.duplicate_queries
+        response["Server-Timing"] = (
+            f"total;dur={elapsed * 1000:.1f}, "
+            f"db;dur={stats.db_time * 1000:.1f}, "
+            f"serializer;dur={stats.serializer_time * 1000:.1f}"
+        )
+
+
+def render_metrics():
+    """Метрики текущего процесса в текстовом формате Prometheus"""
+    with _lock:
+        views = {view: Counter(metrics) for view, metrics in _views.items()}
+        counters = Counter(_counters)
+
+    lines = []
+    for metric, help_text in (
+        ("requests", "Число запросов"),
+        ("seconds", "Суммарное время ответа"),
+        ("db_queries", "Число SQL запросов"),
+        ("db_seconds", "Суммарное время SQL запросов"),
+        ("serializer_seconds", "Суммарное время сериализации"),
+        ("duplicate_queries", "Повторы одинаковых SQL запросов"),
+    ):
+        name = f"api_view_{metric}_total"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for view, metrics in sorted(views.items()):
+            lines.append(f'{name}{{view="{view}"}} {metrics[metric]}')
+
+    for counter, value in sorted(counters.items()):
+        name = f"api_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,113 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.compat import SHORT_SEPARATORS
+from rest_framework.exceptions import ParseError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Даты, dataclass и подклассы отдаются энкодеру DRF, чтобы вывод
+    # совпадал с json.dumps байт в байт
+    ORJSON_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+
+def escape_separators(content):
+    """JSONRenderer DRF экранирует U+2028 и U+2029, их не любит JS"""
+    return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+        b"\xe2\x80\xa9", b"\\u2029"
+    )
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer на orjson, если он установлен.
+
+    Вывод совпадает с JSONRenderer DRF: компактный UTF-8 без
+    экранирования кириллицы. С отступами, ensure_ascii и для данных,
+    которые orjson не умеет кодировать, работает обычный json.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not self.is_compact(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.encode(data)
+
+    def is_compact(self, accepted_media_type, renderer_context):
+        indent = self.get_indent(
+            accepted_media_type or "", renderer_context or {}
+        )
+        return not indent and self.compact and not self.ensure_ascii
+
+    def encode(self, data):
+        """Компактный JSON, в том числе null для None"""
+        if orjson is not None:
+            try:
+                return escape_separators(
+                    orjson.dumps(
+                        data,
+                        default=self.encoder_class().default,
+                        option=ORJSON_OPTIONS,
+                    )
+                )
+            except TypeError:
+                # Например, целые больше 64 бит
+                pass
+        content = json.dumps(
+            data,
+            cls=self.encoder_class,
+            ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict,
+            separators=SHORT_SEPARATORS,
+        )
+        return escape_separators(content.encode())
+
+    def iter_render(self, data, chunk_size=None):
+        """Тот же JSON частями: списки кодируются пачками по chunk_size
+        элементов, и большой ответ не собирается в памяти целиком."""
+        chunk_size = chunk_size or settings.API_JSON_STREAM_CHUNK_SIZE
+        if isinstance(data, dict):
+            yield b"{"
+            for number, (key, value) in enumerate(data.items()):
+                # {"key":0} -> "key", ключи приводятся к строке как в json
+                key = self.encode({key: 0})[1:-3]
+                yield (b"," if number else b"") + key + b":"
+                if isinstance(value, list):
+                    yield from self.iter_render(value, chunk_size)
+                else:
+                    yield self.encode(value)
+            yield b"}"
+        elif isinstance(data, list):
+            yield b"["
+            for start in range(0, len(data), chunk_size):
+                chunk = self.encode(data[start:start + chunk_size])[1:-1]
+                yield (b"," if start else b"") + chunk
+            yield b"]"
+        else:
+            yield self.encode(data)
+
+
+class JSONParser(parsers.JSONParser):
+    """JSONParser на orjson для тел в UTF-8"""
+
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -1,38 +1,197 @@
 import base64
+import binascii
+import hashlib
+import tempfile
+from collections import OrderedDict
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from django.db.models import Manager
+from PIL import Image
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import get_object_or_404
 from rest_framework.relations import SlugRelatedField
+from rest_framework.settings import api_settings
 
-from recipes import models
+from . import snapshots
+from recipes import matching, models, search, services
 from users.models import Subscribe
 from users.serializers import UserSerializer
 
 User = get_user_model()
 
 
+def get_model_fields(model, serializer, prefix=""):
+    """Колонки модели, которые читают поля сериализатора, для only().
+    Для вложенных сериализаторов внешних ключей колонки берутся через
+    author__email и т.п."""
+    names = []
+    for field in serializer.fields.values():
+        for source in getattr(field, "model_fields", [field.source]):
+            try:
+                model_field = model._meta.get_field(source.split(".")[0])
+            except FieldDoesNotExist:
+                continue
+            if not model_field.concrete or model_field.many_to_many:
+                continue
+            names.append(prefix + model_field.name)
+            if model_field.is_relation and isinstance(
+                field, serializers.ModelSerializer
+            ):
+                names.extend(
+                    get_model_fields(
+                        model_field.related_model,
+                        field,
+                        f"{prefix}{model_field.name}__",
+                    )
+                )
+    return names
+
+
+class SparseFieldsSerializerMixin:
+    """Оставляет только поля из fields и убирает поля из omit.
+
+    id отдается всегда: по нему сбрасывается кэш ответов.
+    """
+
+    required_fields = ("id",)
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = fields
+        self.omitted_fields = omit or ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = set(self.selected_fields or ()) | set(self.omitted_fields)
+        unknown = requested - set(fields)
+        if unknown:
+            raise ValidationError(
+                {"fields": f"Неизвестные поля: {', '.join(sorted(unknown))}"}
+            )
+
+        names = set(fields)
+        if self.selected_fields is not None:
+            names = set(self.selected_fields)
+        names.difference_update(self.omitted_fields)
+        names.update(self.required_fields)
+        return OrderedDict(
+            (name, field) for name, field in fields.items() if name in names
+        )
+
+    def get_model_fields(self):
+        return get_model_fields(self.Meta.model, self)
+
+
 class Base64ImageField(serializers.ImageField):
+    """Картинка в base64. Декодируется кусками во временный файл,
+    размер проверяется до декодирования, а файл называется по sha256
+    содержимого: повторная загрузка той же картинки не создает копию."""
+
+    default_error_messages = {
+        "base64": "Некорректная картинка в base64",
+        "max_bytes": "Картинка больше {max_bytes} байт",
+        "max_pixels": "Картинка больше {max_pixels} пикселей",
+    }
+    chunk_size = 64 * 1024
+    extensions = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
-            ext = format.split("/")[-1]
-            data = ContentFile(base64.b64decode(imgstr), name="temp." + ext)
+        if not (isinstance(data, str) and data.startswith("data:image")):
+            return super().to_internal_value(data)
 
-        return super().to_internal_value(data)
+        stream, digest = self.decode(data)
+        try:
+            stream.seek(0)
+            with Image.open(stream) as image:
+                image_format = image.format
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail("invalid_image")
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            self.fail(
+                "max_pixels", max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS
+            )
+        if image_format not in self.extensions:
+            self.fail("invalid_image")
+
+        name = f"{digest}.{self.extensions[image_format]}"
+        field = models.Recipe._meta.get_field("image")
+        path = field.generate_filename(None, name)
+        if field.storage.exists(path):
+            stream.close()
+            return path
+
+        stream.seek(0)
+        return super().to_internal_value(File(stream, name=name))
+
+    def decode(self, data):
+        _, _, payload = data.partition(";base64,")
+        # Клиенты переносят base64 по строкам (MIME, 76 символов),
+        # b64decode с validate=True пробелы не пропускает
+        payload = "".join(payload.split())
+        padding = payload[-2:].count("=")
+        size = len(payload) * 3 // 4 - padding
+        if not payload or len(payload) % 4:
+            self.fail("base64")
+        if size > settings.RECIPE_IMAGE_MAX_BYTES:
+            self.fail("max_bytes", max_bytes=settings.RECIPE_IMAGE_MAX_BYTES)
+
+        stream = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(payload), self.chunk_size):
+                chunk = base64.b64decode(
+                    payload[start:start + self.chunk_size], validate=True
+                )
+                digest.update(chunk)
+                stream.write(chunk)
+        except binascii.Error:
+            stream.close()
+            self.fail("base64")
+        return stream, digest.hexdigest()
 
 
-class TagSerializer(serializers.ModelSerializer):
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки: {ширина: url}"""
+
+    model_fields = ["image", "image_variants"]
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variants = recipe.image_variants
+        if not recipe.image or variants.get("source") != recipe.image.name:
+            return {}
+
+        request = self.context.get("request")
+        storage = recipe.image.storage
+        urls = {}
+        for width, name in variants["widths"].items():
+            url = storage.url(name)
+            urls[width] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+class TagSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
-        fields = "__all__"
+        fields = ["id", "name", "color", "slug"]
         model = models.Tag
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    SparseFieldsSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
-        fields = "__all__"
+        fields = ["id", "name", "measurement_unit"]
         model = models.Ingredient
 
 
@@ -48,21 +207,39 @@ class RecipeIngredientsSerializer(serializers.ModelSerializer):
         model = models.RecipeIngredients
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        if not self.child.use_snapshots():
+            return super().to_representation(data)
+        recipes = data.all() if isinstance(data, Manager) else data
+        return self.child.from_snapshots(list(recipes))
+
+
+class RecipeSerializer(
+    SparseFieldsSerializerMixin, serializers.ModelSerializer
+):
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientsSerializer(
         many=True, source="ingredientsamount"
     )
     tags = TagSerializer(many=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField(source="favorite_recipes")
     is_in_shopping_cart = serializers.SerializerMethodField(
         source="shopping_cart"
     )
 
     class Meta:
-        exclude = ["favorite"]
+        exclude = [
+            "favorite",
+            "updated_at",
+            "search_ingredients",
+            "favorites_count",
+            "in_carts_count",
+        ]
         model = models.Recipe
+        list_serializer_class = RecipeListSerializer
 
     def validate(self, data):
         if not data["tags"]:
@@ -80,35 +257,80 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "Ингридиенты не должны повторяться"
             )
+
+        existing_ids = models.Ingredient.objects.in_bulk(ingredient_ids)
+        missing_ids = [i for i in ingredient_ids if i not in existing_ids]
+        if missing_ids:
+            raise serializers.ValidationError(
+                "Ингредиенты не найдены: {0}".format(
+                    ", ".join(map(str, missing_ids))
+                )
+            )
         return data
 
     def create(self, validated_data):
         ingredients_amount_data = validated_data.pop("ingredientsamount")
         instance = super().create(validated_data)
         self.ingredients_set(ingredients_amount_data, instance)
+        search.update_documents([instance.pk])
+        matching.mark_changed([instance.pk])
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_amount_data = validated_data.pop("ingredientsamount")
         instance = super().update(instance, validated_data)
-        models.RecipeIngredients.objects.filter(recipe=instance).delete()
-        self.ingredients_set(ingredients_amount_data, instance)
+        old_amounts, new_amounts = self.ingredients_set(
+            ingredients_amount_data,
+            instance,
+            instance.ingredientsamount.all(),
+        )
+        services.apply_shopping_list_delta(
+            services.get_cart_user_ids(instance),
+            services.get_amounts_delta(old_amounts, new_amounts),
+        )
+        search.update_documents([instance.pk])
+        matching.mark_changed([instance.pk])
 
         return instance
 
-    def ingredients_set(self, ingredients_amount_data, recipe_instance):
-        ingredients = []
-        for ingredient_amount in ingredients_amount_data:
-            ingredient_id = ingredient_amount["ingredient"]["id"]
-            ingredient = get_object_or_404(models.Ingredient, pk=ingredient_id)
-            amount = ingredient_amount["amount"]
-
-            recipe_ingredients_instance = models.RecipeIngredients(
-                ingredient=ingredient, recipe=recipe_instance, amount=amount
+    def ingredients_set(
+        self, ingredients_amount_data, recipe_instance, current=()
+    ):
+        """Приводит состав рецепта к переданному, меняя только
+        отличающиеся строки. Возвращает старый и новый состав."""
+        new_amounts = {
+            i["ingredient"]["id"]: i["amount"] for i in ingredients_amount_data
+        }
+        old_amounts = {}
+        to_update = []
+        to_delete = []
+
+        for recipe_ingredient in current:
+            ingredient_id = recipe_ingredient.ingredient_id
+            old_amounts[ingredient_id] = recipe_ingredient.amount
+
+            if ingredient_id not in new_amounts:
+                to_delete.append(recipe_ingredient.pk)
+            elif recipe_ingredient.amount != new_amounts[ingredient_id]:
+                recipe_ingredient.amount = new_amounts[ingredient_id]
+                to_update.append(recipe_ingredient)
+
+        if to_delete:
+            models.RecipeIngredients.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            models.RecipeIngredients.objects.bulk_update(to_update, ["amount"])
+        models.RecipeIngredients.objects.bulk_create(
+            models.RecipeIngredients(
+                ingredient_id=ingredient_id,
+                recipe=recipe_instance,
+                amount=amount,
             )
-            ingredients.append(recipe_ingredients_instance)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in old_amounts
+        )
 
-        models.RecipeIngredients.objects.bulk_create(ingredients)
+        return old_amounts, new_amounts
 
     def get_is_favorited(self, recipe):
         user = self.context.get("request").user
@@ -116,6 +338,10 @@ class RecipeSerializer(serializers.ModelSerializer):
         if user.is_anonymous:
             return False
 
+        is_favorited = getattr(recipe, "is_favorited", None)
+        if is_favorited is not None:
+            return is_favorited
+
         return recipe.favorite_recipes.filter(user=user).exists()
 
     def get_is_in_shopping_cart(self, recipe):
@@ -124,8 +350,73 @@ class RecipeSerializer(serializers.ModelSerializer):
         if user.is_anonymous:
             return False
 
+        in_cart = getattr(recipe, "is_in_shopping_cart", None)
+        if in_cart is not None:
+            return in_cart
+
         return recipe.shopping_cart.filter(user=user).exists()
 
+    def to_representation(self, instance):
+        if self.use_snapshots():
+            return self.from_snapshots([instance])[0]
+
+        is_subscribed = getattr(instance, "author_is_subscribed", None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
+
+    def use_snapshots(self):
+        return self.context.get("snapshots", False)
+
+    def build_snapshots(self, recipe_ids):
+        """Полные представления рецептов без полей пользователя"""
+        recipes = list(
+            models.Recipe.objects.with_relations().filter(pk__in=recipe_ids)
+        )
+        request = snapshots.SnapshotRequest(self.context["request"])
+        data = RecipeSerializer(
+            recipes, many=True, context={"request": request}
+        ).data
+        return zip(recipes, data)
+
+    def from_snapshots(self, recipes):
+        """Представления из снимков, дополненные полями текущего
+        пользователя"""
+        found = snapshots.get_many(
+            recipes, self.context["request"], self.build_snapshots
+        )
+        return [
+            self.merge_snapshot(recipe, found[recipe.pk])
+            for recipe in recipes
+            if recipe.pk in found
+        ]
+
+    def merge_snapshot(self, recipe, snapshot):
+        data = OrderedDict()
+        for name in self.fields:
+            if name == "is_favorited":
+                data[name] = self.get_is_favorited(recipe)
+            elif name == "is_in_shopping_cart":
+                data[name] = self.get_is_in_shopping_cart(recipe)
+            elif name == "author":
+                data[name] = dict(
+                    snapshot[name], is_subscribed=self.is_subscribed(recipe)
+                )
+            else:
+                data[name] = snapshot[name]
+        return data
+
+    def is_subscribed(self, recipe):
+        user = self.context["request"].user
+        if user.is_anonymous:
+            return False
+
+        is_subscribed = getattr(recipe, "author_is_subscribed", None)
+        if is_subscribed is not None:
+            return is_subscribed
+
+        return user.subscribers.filter(author_id=recipe.author_id).exists()
+
     def to_internal_value(self, data):
         self.fields["tags"] = serializers.PrimaryKeyRelatedField(
             many=True, queryset=models.Tag.objects.all()
@@ -134,61 +425,74 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 
 class CustomRecipeSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         fields = [
             "id",
             "name",
             "image",
+            "image_variants",
             "cooking_time",
         ]
         model = models.Recipe
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для пакетных операций"""
+
+    max_items = 100
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=max_items,
+    )
+
+
+class UniqueRelationMixin:
+    """Создает связь одним INSERT без проверки перед вставкой: повтор
+    ловит уникальное ограничение базы, а IntegrityError превращается
+    в ошибку валидации с unique_message."""
+
+    unique_message = None
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise ValidationError(self.unique_message)
+
+
+class FavoriteSerializer(UniqueRelationMixin, serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
     user = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
+    unique_message = {
+        api_settings.NON_FIELD_ERRORS_KEY: ["Рецепт уже в избранном!"]
+    }
 
     class Meta:
         fields = "__all__"
         model = models.FavoriteRecipe
 
-    def validate(self, attrs):
-        request = self.context.get("request")
-        recipe_id = self.context.get("view").kwargs.get("recipe_id")
-        user = request.user
-
-        is_favorite = user.favorite_recipes.filter(
-            recipe_id=recipe_id).exists()
-
-        if is_favorite and request.method == "POST":
-            raise ValidationError("Рецепт уже в избранном!")
-        return attrs
-
     def to_representation(self, instance):
         request = self.context.get("request")
         context = {"request": request}
         return CustomRecipeSerializer(instance.recipe, context=context).data
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(UniqueRelationMixin, serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
     user = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
+    unique_message = {
+        api_settings.NON_FIELD_ERRORS_KEY: ["Рецепт уже в списке покупок!"]
+    }
 
     class Meta:
         fields = "__all__"
         model = models.ShoppingCart
 
-    def validate(self, attrs):
-        request = self.context.get("request")
-        recipe_id = self.context.get("view").kwargs.get("recipe_id")
-        user = request.user
-
-        in_cart = user.shopping_cart.filter(recipe_id=recipe_id).exists()
-
-        if in_cart and request.method == "POST":
-            raise ValidationError("Рецепт уже в списке покупок!")
-        return attrs
-
     def to_representation(self, instance):
         request = self.context.get("request")
         context = {"request": request}
@@ -198,18 +502,23 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
 class PreviewRecipeSerializer(serializers.ModelSerializer):
     """Краткое отображение рецепта."""
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = models.Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
 
 
-class UserSubscribeSerializer(serializers.ModelSerializer):
+class UserSubscribeSerializer(
+    UniqueRelationMixin, serializers.ModelSerializer
+):
     subscriber = SlugRelatedField(
         slug_field="username",
         read_only=True,
         default=serializers.CurrentUserDefault(),
     )
     author = SlugRelatedField(slug_field="username", read_only=True)
+    unique_message = {"detail": "Вы уже подписаны на автора"}
 
     class Meta:
         fields = "__all__"
@@ -221,27 +530,34 @@ class UserSubscribeSerializer(serializers.ModelSerializer):
 
         if subscriber == author:
             raise serializers.ValidationError("Нельзя подписаться на себя!")
-
-        if subscriber.authors.filter(author=author).exists():
-            raise serializers.ValidationError(
-                {"detail": "Вы уже подписаны на автора"}
-            )
         return super().create(validated_data)
 
-    def to_representation(self, instance):
-        request = self.context.get("request")
-        context = {"request": request}
-
-        author_data = UserSerializer(instance.author, context=context).data
-        recipes_data = PreviewRecipeSerializer(
-            instance.author.own_recipes.all(), many=True
-        ).data
-        author_data["recipes_count"] = len(recipes_data)
+    @staticmethod
+    def get_recipes_limit(request):
         recipes_limit = request.query_params.get("recipes_limit")
+        if not recipes_limit:
+            return None
         try:
-            if recipes_limit:
-                recipes_data = recipes_data[: int(recipes_limit)]
+            return int(recipes_limit)
         except ValueError:
             raise ValidationError("Параметр recipes_limit должен быть числом!")
-        author_data["recipes"] = recipes_data
+
+    def to_representation(self, instance):
+        request = self.context.get("request")
+        context = {"request": request}
+        author = instance.author
+        author.is_subscribed = instance.subscriber_id == request.user.id
+
+        recipes = getattr(author, "limited_recipes", None)
+        if recipes is None:
+            recipes = author.own_recipes.all()
+            recipes_limit = self.get_recipes_limit(request)
+            if recipes_limit is not None:
+                recipes = recipes[: max(recipes_limit, 0)]
+
+        author_data = UserSerializer(author, context=context).data
+        author_data["recipes_count"] = author.recipes_count
+        author_data["recipes"] = PreviewRecipeSerializer(
+            recipes, many=True
+        ).data
         return author_data
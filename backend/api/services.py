@@ -1,23 +1,45 @@
-from django.db.models import F, Sum
+from django.db.models import F
 from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
 
-from recipes.models import ShoppingCart
+from . import exporters
+from recipes.models import ShoppingListItem
 
 
-def download_shopping_cart(user):
-    user_cart = ShoppingCart.objects.filter(user=user)
-    total_ingredients = user_cart.values(
-        ingredient=F("recipe__ingredients__name"),
-        measurement_unit=F("recipe__ingredients__measurement_unit"),
-    ).annotate(amount=Sum("recipe__ingredientsamount__amount"))
+def get_shopping_cart_ingredients(user):
+    """Суммарное количество ингредиентов из корзины пользователя"""
+    return (
+        ShoppingListItem.objects.filter(user=user)
+        .annotate(
+            ingredient_name=F("ingredient__name"),
+            measurement_unit=F("ingredient__measurement_unit"),
+            amount=F("total_amount"),
+        )
+        .order_by("ingredient_name")
+    )
+
+
+def download_shopping_cart(user, file_format="txt"):
+    exporter = exporters.get_exporter(file_format)
+    if exporter is None:
+        raise ValidationError(
+            {
+                "format": (
+                    f"Формат {file_format} не поддерживается, доступны: "
+                    + ", ".join(exporters.EXPORTERS)
+                )
+            }
+        )
 
-    filename = "my-file.txt"
-    content = "\n".join(
-        "{ingredient} ({measurement_unit}) — {amount}".format_map(ingredient)
-        for ingredient in total_ingredients
+    total_ingredients = list(
+        get_shopping_cart_ingredients(user).values_list(
+            "ingredient_name", "measurement_unit", "amount"
+        )
     )
+    content = exporters.export(exporter, total_ingredients)
 
-    response = HttpResponse(content, content_type="text/plain")
+    filename = f"my-file.{exporter.extension}"
+    response = HttpResponse(content, content_type=exporter.content_type)
     response["Content-Disposition"] = "attachment; filename={0}".format(
         filename
     )
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, cache
+from .filters import invalidate_tag_ids
+from recipes import models
+
+User = get_user_model()
+
+
+def invalidate_on_commit(*tags):
+    transaction.on_commit(lambda: cache.invalidate(*tags))
+
+
+@receiver(post_save, sender=models.Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate_on_commit("recipes", f"recipe:{instance.pk}")
+    else:
+        invalidate_on_commit(f"recipe:{instance.pk}")
+
+
+@receiver(post_delete, sender=models.Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    invalidate_on_commit("recipes", f"recipe:{instance.pk}")
+
+
+@receiver([post_save, post_delete], sender=models.RecipeIngredients)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    invalidate_on_commit(f"recipe:{instance.recipe_id}")
+
+
+@receiver(m2m_changed, sender=models.Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set is not None:
+        recipe_ids = pk_set
+    else:
+        invalidate_on_commit("recipes", f"tag:{instance.pk}")
+        return
+    invalidate_on_commit(
+        "recipes", *(f"recipe:{recipe_id}" for recipe_id in recipe_ids)
+    )
+
+
+@receiver(post_save, sender=models.Tag)
+def tag_saved(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_tag_ids)
+    invalidate_on_commit(f"tag:{instance.pk}")
+
+
+@receiver(post_delete, sender=models.Tag)
+def tag_deleted(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_tag_ids)
+    invalidate_on_commit("recipes", f"tag:{instance.pk}")
+
+
+@receiver([post_save, post_delete], sender=models.Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    invalidate_on_commit(f"ingredient:{instance.pk}")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login", "password"}:
+        return
+    invalidate_on_commit(f"user:{instance.pk}")
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """Смена пароля, деактивация и правка профиля сбрасывают
+    закэшированные токены пользователя"""
+    if created or update_fields and set(update_fields) <= {"last_login"}:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: authentication.invalidate_user(user_id))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    key, user_id = instance.key, instance.user_id
+    transaction.on_commit(lambda: authentication.invalidate(key, user_id))
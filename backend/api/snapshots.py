@@ -0,0 +1,57 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+
+# Меняется вместе с форматом представления рецепта
+VERSION = 1
+KEY_PREFIX = "recipe-snapshot:"
+
+# Колонки рецепта, которых достаточно, чтобы найти снимок и дополнить
+# его полями пользователя
+ROW_FIELDS = ["author", "updated_at"]
+
+
+def get_cache():
+    return caches[settings.RECIPE_SNAPSHOT_CACHE]
+
+
+class SnapshotRequest:
+    """Запрос без пользователя: снимок не должен зависеть от того,
+    кто его построил, а ссылки строятся от хоста исходного запроса"""
+
+    user = AnonymousUser()
+
+    def __init__(self, request):
+        self.build_absolute_uri = request.build_absolute_uri
+
+
+def get_key(recipe, request):
+    """Ключ меняется вместе с updated_at, который обновляют сигналы при
+    изменении рецепта, его ингредиентов, тегов и автора"""
+    host = hashlib.sha1(request.build_absolute_uri("/").encode()).hexdigest()
+    return (
+        f"{KEY_PREFIX}{VERSION}:{host[:12]}:{recipe.pk}:"
+        f"{recipe.updated_at.timestamp()}"
+    )
+
+
+def get_many(recipes, request, build):
+    """Снимки рецептов {id: данные}. Недостающие строит build(ids),
+    возвращающий пары (рецепт, данные), и кладет в кэш."""
+    cache = get_cache()
+    keys = {get_key(recipe, request): recipe.pk for recipe in recipes}
+    found = {
+        keys[key]: snapshot
+        for key, snapshot in cache.get_many(list(keys)).items()
+    }
+
+    missing = [pk for pk in keys.values() if pk not in found]
+    if missing:
+        built = {}
+        for recipe, snapshot in build(missing):
+            found[recipe.pk] = snapshot
+            built[get_key(recipe, request)] = snapshot
+        cache.set_many(built, settings.RECIPE_SNAPSHOT_TIMEOUT)
+    return found
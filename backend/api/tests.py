@@ -0,0 +1,260 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .filters import RecipeFilter
+from recipes import models
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f"user{number}@example.com",
+        username=f"user{number}",
+        password="password",
+        first_name="Имя",
+        last_name="Фамилия",
+    )
+
+
+def clear_caches():
+    for alias in ("default", "api", "snapshots"):
+        caches[alias].clear()
+
+
+class RecipeListQueriesTest(TestCase):
+    """Страница списка рецептов стоит одинаковое число запросов при
+    любом размере страницы"""
+
+    PAGE_SIZE = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        authors = [create_user(number) for number in range(1, 4)]
+        Subscribe.objects.create(subscriber=cls.user, author=authors[0])
+        tags = [
+            models.Tag.objects.create(
+                name=f"Тег {number}", color="#ffffff", slug=f"tag{number}"
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            models.Ingredient.objects.create(
+                name=f"Ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(4)
+        ]
+        for number in range(cls.PAGE_SIZE * 2):
+            recipe = models.Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f"Рецепт {number}",
+                image="recipes/recipe.png",
+                text="Описание",
+                cooking_time=10,
+            )
+            recipe.tags.set(tags[: number % len(tags) + 1])
+            models.RecipeIngredients.objects.bulk_create(
+                models.RecipeIngredients(
+                    recipe=recipe, ingredient=ingredient, amount=100
+                )
+                for ingredient in ingredients[: number % 3 + 1]
+            )
+            if number % 2:
+                models.FavoriteRecipe.objects.create(
+                    recipe=recipe, user=cls.user
+                )
+            if number % 3:
+                models.ShoppingCart.objects.create(
+                    recipe=recipe, user=cls.user
+                )
+
+    def count_queries(self, client, limit):
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get("/api/recipes/", {"limit": limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), limit)
+        return len(context.captured_queries)
+
+    def assert_constant_queries(self, client):
+        expected = self.count_queries(client, self.PAGE_SIZE)
+        clear_caches()
+        with self.assertNumQueries(expected):
+            response = client.get(
+                "/api/recipes/", {"limit": self.PAGE_SIZE * 2}
+            )
+        self.assertEqual(len(response.data["results"]), self.PAGE_SIZE * 2)
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for use_snapshots in (False, True):
+            with self.subTest(snapshots=use_snapshots), override_settings(
+                RECIPE_SNAPSHOTS=use_snapshots
+            ):
+                self.assert_constant_queries(client)
+
+    def test_anonymous(self):
+        for use_snapshots in (False, True):
+            with self.subTest(snapshots=use_snapshots), override_settings(
+                RECIPE_SNAPSHOTS=use_snapshots
+            ):
+                self.assert_constant_queries(APIClient())
+
+    def test_user_flags(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        clear_caches()
+        response = client.get("/api/recipes/", {"limit": self.PAGE_SIZE * 2})
+        favorited = set(
+            models.FavoriteRecipe.objects.filter(user=self.user).values_list(
+                "recipe_id", flat=True
+            )
+        )
+        in_cart = set(
+            models.ShoppingCart.objects.filter(user=self.user).values_list(
+                "recipe_id", flat=True
+            )
+        )
+        for recipe in response.data["results"]:
+            self.assertEqual(recipe["is_favorited"], recipe["id"] in favorited)
+            self.assertEqual(
+                recipe["is_in_shopping_cart"], recipe["id"] in in_cart
+            )
+            self.assertEqual(
+                recipe["author"]["is_subscribed"],
+                recipe["author"]["username"] == "user1",
+            )
+
+
+class RecipeTagFilterTest(TestCase):
+    """Фильтр по тегам: каждый рецепт в выдаче один раз, число
+    результатов совпадает с count, в SQL полусоединение без DISTINCT"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user(0)
+        cls.tags = {
+            slug: models.Tag.objects.create(
+                name=slug, color="#ffffff", slug=slug
+            )
+            for slug in ("breakfast", "lunch", "dinner")
+        }
+        # Рецепт с номером number получает теги по битам номера
+        cls.recipe_tags = {}
+        for number in range(24):
+            recipe = models.Recipe.objects.create(
+                author=author,
+                name=f"Рецепт {number}",
+                image="recipes/recipe.png",
+                text="Описание",
+                cooking_time=10,
+            )
+            slugs = {
+                slug
+                for bit, slug in enumerate(cls.tags)
+                if number & (1 << bit)
+            }
+            recipe.tags.set(cls.tags[slug] for slug in slugs)
+            cls.recipe_tags[recipe.pk] = slugs
+
+    def setUp(self):
+        clear_caches()
+
+    def expected(self, slugs, match_all=False):
+        if match_all:
+            check = set(slugs).issubset
+        else:
+            check = set(slugs).intersection
+        return {
+            recipe_id
+            for recipe_id, recipe_slugs in self.recipe_tags.items()
+            if check(recipe_slugs)
+        }
+
+    def fetch_all(self, params):
+        """id рецептов со всех страниц и count первой страницы"""
+        client = APIClient()
+        ids = []
+        page = 1
+        while True:
+            response = client.get(
+                "/api/recipes/", {**params, "limit": 5, "page": page}
+            )
+            self.assertEqual(response.status_code, 200)
+            if page == 1:
+                count = response.data["count"]
+            ids.extend(recipe["id"] for recipe in response.data["results"])
+            if response.data["next"] is None:
+                return ids, count
+            page += 1
+
+    def assert_results(self, params, expected):
+        ids, count = self.fetch_all(params)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(count, len(ids))
+        self.assertEqual(set(ids), expected)
+
+    def test_single_tag(self):
+        self.assert_results({"tags": ["lunch"]}, self.expected(["lunch"]))
+
+    def test_any_of(self):
+        slugs = ["breakfast", "dinner"]
+        self.assert_results({"tags": slugs}, self.expected(slugs))
+
+    def test_all_of(self):
+        slugs = ["breakfast", "dinner"]
+        self.assert_results(
+            {"tags": slugs, "tags_match": "all"},
+            self.expected(slugs, match_all=True),
+        )
+
+    def test_unknown_slug(self):
+        self.assert_results(
+            {"tags": ["breakfast", "unknown"]}, self.expected(["breakfast"])
+        )
+        self.assert_results(
+            {"tags": ["breakfast", "unknown"], "tags_match": "all"}, set()
+        )
+
+    def test_new_tag_visible_after_caching(self):
+        self.fetch_all({"tags": ["breakfast"]})
+        tag = models.Tag.objects.create(
+            name="supper", color="#000000", slug="supper"
+        )
+        recipe_id = next(iter(self.recipe_tags))
+        models.Recipe.objects.get(pk=recipe_id).tags.add(tag)
+        self.assert_results({"tags": ["supper"]}, {recipe_id})
+
+    def get_sql(self, params):
+        data = QueryDict(mutable=True)
+        for name, values in params.items():
+            data.setlist(name, values)
+        queryset = RecipeFilter(
+            data, queryset=models.Recipe.objects.all()
+        ).qs
+        return str(queryset.query).upper()
+
+    def test_query_shape(self):
+        for params in (
+            {"tags": ["lunch"]},
+            {"tags": ["breakfast", "dinner"]},
+            {"tags": ["breakfast", "dinner"], "tags_match": ["all"]},
+        ):
+            with self.subTest(**params):
+                sql = self.get_sql(params)
+                self.assertIn("EXISTS", sql)
+                self.assertNotIn("DISTINCT", sql)
+                self.assertNotIn("JOIN", sql)
+                self.assertNotIn("SLUG", sql)
+        sql = self.get_sql(
+            {"tags": ["breakfast", "dinner"], "tags_match": ["all"]}
+        )
+        self.assertEqual(sql.count("EXISTS"), 2)
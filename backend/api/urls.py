@@ -43,7 +43,25 @@ router_v1.register("tags", views.TagViewSet)
 router_v1.register("ingredients", views.IngredientViewSet)
 
 
+bulk_actions = {"post": "bulk_create", "delete": "bulk_delete"}
+
 urlpatterns = [
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
+    path(
+        "recipes/favorite/",
+        views.FavoriteViewSet.as_view(bulk_actions),
+        name="favorite-bulk",
+    ),
+    path(
+        "recipes/shopping_cart/",
+        views.ShoppingCartViewSet.as_view(bulk_actions),
+        name="shopping_cart-bulk",
+    ),
+    path(
+        "users/subscribe/",
+        views.UserSubscribeViewSet.as_view(bulk_actions),
+        name="subscribe-bulk",
+    ),
     path("", include(router_v1.urls)),
     path("", include("djoser.urls")),
     path("auth/", include("djoser.urls.authtoken")),
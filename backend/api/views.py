@@ -1,33 +1,139 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import (
+    SAFE_METHODS,
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from . import mixins, serializers
-from .filters import CustomSearchFilter, RecipeFilter
+from . import cache, mixins, profiling, serializers, snapshots
+from .filters import CustomSearchFilter, RecipeFilter, StableOrderingFilter
 from .mixins import GetViewSet
-from .pagination import LimitPagination, OnlyDataPagination
+from .negotiation import IgnoreFormatContentNegotiation
+from .pagination import (
+    FeedPagination,
+    LimitOrKeysetPagination,
+    LimitPagination,
+    OnlyDataPagination,
+)
 from .permissions import IsAuthorOrStaffOrReadOnly
 from .services import download_shopping_cart
-from recipes import models
+from recipes import autocomplete, feed, matching, models, services
 from users.models import Subscribe
 
 User = get_user_model()
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    mixins.StreamingJSONMixin,
+    mixins.ConditionalGetMixin,
+    mixins.AnonymousCacheMixin,
+    mixins.SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     permission_classes = [IsAuthorOrStaffOrReadOnly]
     queryset = models.Recipe.objects.all()
     serializer_class = serializers.RecipeSerializer
-    pagination_class = LimitPagination
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    pagination_class = LimitOrKeysetPagination
+    filter_backends = [DjangoFilterBackend, StableOrderingFilter]
     filterset_class = RecipeFilter
     filterset_fields = ["tags", "author__id"]
+    ordering_fields = [
+        "create_date",
+        "name",
+        "cooking_time",
+        "favorites_count",
+        "in_carts_count",
+    ]
     ordering = ["-create_date"]
+    cursor_ordering = ["-create_date", "-id"]
+    card_fields = [
+        "id",
+        "name",
+        "image",
+        "image_variants",
+        "cooking_time",
+        "tags",
+        "author",
+        "is_favorited",
+        "is_in_shopping_cart",
+    ]
+    card_actions = ("list", "feed", "match")
+
+    def use_snapshots(self):
+        return (
+            settings.RECIPE_SNAPSHOTS and self.request.method in SAFE_METHODS
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["snapshots"] = self.use_snapshots()
+        return context
+
+    def get_queryset(self):
+        fields = self.get_selected_fields()
+        if fields is None and not self.use_snapshots():
+            return models.Recipe.objects.with_relations().with_user_flags(
+                self.request.user
+            )
+        if fields is None:
+            fields = set(self.get_serializer().fields)
+
+        queryset = models.Recipe.objects.with_user_flags(
+            self.request.user,
+            favorited="is_favorited" in fields,
+            in_cart="is_in_shopping_cart" in fields,
+            subscribed="author" in fields,
+        )
+        if self.use_snapshots():
+            # Представление собирается из снимков, нужны только ключи
+            return queryset.only(
+                *snapshots.ROW_FIELDS,
+                *(name.lstrip("-") for name in self.cursor_ordering),
+            )
+
+        return queryset.with_relations(
+            author="author" in fields,
+            tags="tags" in fields,
+            ingredients="ingredients" in fields,
+        ).only(*self.get_model_fields())
+
+    def get_validators(self):
+        if self.action != "retrieve" or not self.request.user.is_anonymous:
+            return None, None
+
+        updated_at = (
+            models.Recipe.objects.filter(pk=self.kwargs.get("pk"))
+            .values_list("updated_at", flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return None, None
+        etag = quote_etag(
+            f"recipe-{self.kwargs['pk']}-{updated_at.timestamp()}"
+        )
+        return etag, updated_at
+
+    def get_cache_tags(self, data, action):
+        if action == "retrieve":
+            return cache.get_recipe_tags(data)
+
+        tags = {"recipes"}
+        for recipe_data in data["results"]:
+            tags.update(cache.get_recipe_tags(recipe_data))
+        return tags
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -35,21 +141,78 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(methods=["delete"], detail=True)
     def delete(self, request, recipe_id):
         recipe = get_object_or_404(models.Recipe, pk=recipe_id)
-        recipe.delete()
+        self.perform_destroy(recipe)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь"""
+        rows = self.paginate_queryset(feed.Feed(request.user))
+        recipes = self.get_queryset().in_bulk([row.id for row in rows])
+        data = self.get_serializer(
+            [recipes[row.id] for row in rows if row.id in recipes], many=True
+        ).data
+        return self.get_paginated_response(data)
+
+    @action(detail=False, pagination_class=LimitPagination)
+    def match(self, request):
+        """Рецепты по имеющимся ингредиентам, сначала те, для которых
+        есть наибольшая доля ингредиентов"""
+        try:
+            ingredient_ids = [
+                int(value)
+                for values in request.query_params.getlist("ingredients")
+                for value in values.split(",")
+                if value
+            ]
+            min_coverage = float(request.query_params.get("min_coverage", 0))
+        except ValueError:
+            raise ValidationError(
+                "Параметры ingredients и min_coverage должны быть числами!"
+            )
+        if not ingredient_ids:
+            raise ValidationError("Укажи ингредиенты в параметре ingredients")
 
-class TagViewSet(viewsets.ModelViewSet):
+        page = self.paginate_queryset(
+            matching.match(ingredient_ids, min_coverage)
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        page = [row for row in page if row[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True
+        ).data
+        for item, (_, matched, size) in zip(data, page):
+            item["coverage"] = round(matched / size, 3)
+            item["missing"] = size - matched
+        return self.get_paginated_response(data)
+
+
+class TagViewSet(
+    mixins.ConditionalGetMixin,
+    mixins.SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+):
     permission_classes = [AllowAny]
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
     pagination_class = OnlyDataPagination
 
+    def get_validators(self):
+        return mixins.get_collection_validators(models.Tag.objects.all())
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
-class IngredientViewSet(GetViewSet):
+class IngredientViewSet(
+    mixins.ConditionalGetMixin, mixins.SparseFieldsetMixin, GetViewSet
+):
     permission_classes = [AllowAny]
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
@@ -57,10 +220,51 @@ class IngredientViewSet(GetViewSet):
     filter_backends = [CustomSearchFilter]
     search_fields = ["^name"]
 
+    def get_validators(self):
+        return mixins.get_collection_validators(
+            models.Ingredient.objects.all()
+        )
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(CustomSearchFilter.search_param)
+        if name is None:
+            return super().list(request, *args, **kwargs)
 
-class FavoriteViewSet(mixins.CreateDeleteViewSet):
+        limit = request.query_params.get("limit")
+        try:
+            limit = int(limit) if limit else None
+        except ValueError:
+            raise ValidationError("Параметр limit должен быть числом!")
+        if limit is not None and limit < 1:
+            raise ValidationError("Параметр limit должен быть больше нуля!")
+        items = autocomplete.search(name, limit)
+        fields = self.get_selected_fields()
+        if fields is not None:
+            items = [
+                {key: value for key, value in item.items() if key in fields}
+                for item in items
+            ]
+        return Response(items)
+
+
+class FavoriteViewSet(mixins.BulkRelationMixin, mixins.CreateDeleteViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.FavoriteSerializer
+    target_model = models.Recipe
+    relation_model = models.FavoriteRecipe
+    exists_message = "Рецепт уже в избранном!"
+    missing_message = "Рецепта нет в избранном"
+    not_found_message = "Рецепт не найден"
+
+    def on_bulk_created(self, ids):
+        services.change_counter(
+            models.Recipe.objects.filter(pk__in=ids), "favorites_count", 1
+        )
+
+    def on_bulk_deleted(self, ids):
+        services.change_counter(
+            models.Recipe.objects.filter(pk__in=ids), "favorites_count", -1
+        )
 
     def perform_create(self, serializer):
         recipe = get_object_or_404(
@@ -69,22 +273,58 @@ class FavoriteViewSet(mixins.CreateDeleteViewSet):
 
         title_data = {"recipe": recipe, "user": self.request.user}
 
-        serializer.save(**title_data)
+        with transaction.atomic():
+            services.lock_user(self.request.user)
+            serializer.save(**title_data)
+            services.change_counter(
+                models.Recipe.objects.filter(pk=recipe.pk),
+                "favorites_count",
+                1,
+            )
 
     @action(methods=["delete"], detail=True)
     def delete(self, request, recipe_id):
-        user = self.request.user
-        recipe = get_object_or_404(models.Recipe, pk=recipe_id)
-        favorite = get_object_or_404(
-            models.FavoriteRecipe, user=user, recipe=recipe
-        )
-        favorite.delete()
+        with transaction.atomic():
+            services.lock_user(request.user)
+            deleted, _ = models.FavoriteRecipe.objects.filter(
+                user=request.user, recipe_id=recipe_id
+            ).delete()
+            if not deleted:
+                raise NotFound()
+            services.change_counter(
+                models.Recipe.objects.filter(pk=recipe_id),
+                "favorites_count",
+                -1,
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ShoppingCartViewSet(viewsets.ModelViewSet):
+class ShoppingCartViewSet(mixins.BulkRelationMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.ShoppingCartSerializer
+    content_negotiation_class = IgnoreFormatContentNegotiation
+    target_model = models.Recipe
+    relation_model = models.ShoppingCart
+    exists_message = "Рецепт уже в списке покупок!"
+    missing_message = "Рецепта нет в списке покупок"
+    not_found_message = "Рецепт не найден"
+
+    def on_bulk_created(self, ids):
+        services.apply_shopping_list_delta(
+            [self.request.user.id], services.get_recipes_amounts(ids)
+        )
+        services.change_counter(
+            models.Recipe.objects.filter(pk__in=ids), "in_carts_count", 1
+        )
+
+    def on_bulk_deleted(self, ids):
+        services.apply_shopping_list_delta(
+            [self.request.user.id],
+            services.get_amounts_delta(services.get_recipes_amounts(ids), {}),
+        )
+        services.change_counter(
+            models.Recipe.objects.filter(pk__in=ids), "in_carts_count", -1
+        )
 
     def perform_create(self, serializer):
         recipe = get_object_or_404(
@@ -93,42 +333,128 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
 
         title_data = {"recipe": recipe, "user": self.request.user}
 
-        serializer.save(**title_data)
+        with transaction.atomic():
+            services.lock_user(self.request.user)
+            serializer.save(**title_data)
+            services.add_recipe_to_shopping_list(self.request.user, recipe)
+            services.change_counter(
+                models.Recipe.objects.filter(pk=recipe.pk),
+                "in_carts_count",
+                1,
+            )
 
     def list(self, request, *args, **kwargs):
-        return download_shopping_cart(self.request.user)
+        file_format = request.query_params.get("format", "txt")
+        return download_shopping_cart(self.request.user, file_format)
 
     @action(methods=["delete"], detail=True)
     def delete(self, request, recipe_id):
         user = self.request.user
-        recipe = get_object_or_404(models.Recipe, pk=recipe_id)
-        cart = get_object_or_404(models.ShoppingCart, user=user, recipe=recipe)
-        cart.delete()
+        with transaction.atomic():
+            services.lock_user(user)
+            deleted, _ = models.ShoppingCart.objects.filter(
+                user=user, recipe_id=recipe_id
+            ).delete()
+            if not deleted:
+                raise NotFound()
+            services.remove_recipe_from_shopping_list(user, recipe_id)
+            services.change_counter(
+                models.Recipe.objects.filter(pk=recipe_id),
+                "in_carts_count",
+                -1,
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UserSubscribeViewSet(viewsets.ModelViewSet):
+class UserSubscribeViewSet(
+    mixins.StreamingJSONMixin,
+    mixins.BulkRelationMixin,
+    viewsets.ModelViewSet,
+):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.UserSubscribeSerializer
-    pagination_class = LimitPagination
+    pagination_class = LimitOrKeysetPagination
+    cursor_ordering = ["id"]
+    target_model = User
+    relation_model = Subscribe
+    owner_field = "subscriber"
+    target_field = "author"
+    exists_message = "Вы уже подписаны на автора"
+    missing_message = "Вы не подписаны на автора"
+    not_found_message = "Автор не найден"
+
+    def validate_bulk_target(self, target_id):
+        if target_id == self.request.user.id:
+            return "Нельзя подписаться на себя!"
+        return None
+
+    def on_bulk_created(self, ids):
+        authors = User.objects.filter(pk__in=ids)
+        services.change_counter(authors, "followers_count", 1)
+        feed.follow(self.request.user, *authors.only("id", "followers_count"))
+
+    def on_bulk_deleted(self, ids):
+        services.change_counter(
+            User.objects.filter(pk__in=ids), "followers_count", -1
+        )
+        feed.unfollow(self.request.user, *ids)
 
     def get_queryset(self):
-        return self.request.user.subscribers.all()
+        recipes = models.Recipe.objects.all()
+        recipes_limit = self.serializer_class.get_recipes_limit(self.request)
+        if recipes_limit is not None:
+            top_recipes = models.Recipe.objects.filter(
+                author_id=OuterRef("author_id")
+            ).values("pk")[: max(recipes_limit, 0)]
+            recipes = recipes.filter(pk__in=Subquery(top_recipes))
+
+        return (
+            self.request.user.subscribers.select_related("author")
+            .prefetch_related(
+                Prefetch(
+                    "author__own_recipes",
+                    queryset=recipes,
+                    to_attr="limited_recipes",
+                )
+            )
+        )
 
     def perform_create(self, serializer):
         author = get_object_or_404(User, pk=self.kwargs.get("user_id"))
         title_data = {"subscriber": self.request.user, "author": author}
         if serializer.is_valid():
-            serializer.save(**title_data)
+            with transaction.atomic():
+                services.lock_user(self.request.user)
+                serializer.save(**title_data)
+                services.change_counter(
+                    User.objects.filter(pk=author.pk), "followers_count", 1
+                )
+                feed.follow(self.request.user, author)
 
     @action(methods=["delete"], detail=True)
     def delete(self, request, user_id):
         user = self.request.user
+        with transaction.atomic():
+            services.lock_user(user)
+            deleted, _ = Subscribe.objects.filter(
+                subscriber=user, author_id=user_id
+            ).delete()
+            if not deleted:
+                raise NotFound()
+            services.change_counter(
+                User.objects.filter(pk=user_id), "followers_count", -1
+            )
+            feed.unfollow(user, user_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        author = get_object_or_404(User, pk=user_id)
 
-        subscribe = get_object_or_404(
-            Subscribe, subscriber=user, author=author
+class MetricsView(APIView):
+    """Метрики профилирования в формате Prometheus"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(
+            profiling.render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
         )
-        subscribe.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -30,11 +30,13 @@ INSTALLED_APPS = [
     "django_filters",
     "corsheaders",
     "djoser",
+    "api",
     "recipes",
     "users",
 ]
 
 MIDDLEWARE = [
+    "api.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -81,6 +83,30 @@ DATABASES = {
 }
 
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "api": {
+        "BACKEND": os.getenv(
+            "API_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("API_CACHE_LOCATION", "api"),
+        "TIMEOUT": int(os.getenv("API_CACHE_TIMEOUT", 300)),
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    "snapshots": {
+        "BACKEND": os.getenv(
+            "SNAPSHOT_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("SNAPSHOT_CACHE_LOCATION", "snapshots"),
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -101,7 +127,16 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.renderers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 6,
@@ -139,3 +174,66 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+RECIPE_IMAGE_MAX_BYTES = 5 * 1024 * 1024
+RECIPE_IMAGE_MAX_PIXELS = 6000 * 6000
+RECIPE_IMAGE_WIDTHS = [320, 640, 1280]
+RECIPE_IMAGE_WORKERS = int(os.getenv("RECIPE_IMAGE_WORKERS", 2))
+# Картинка приходит в base64 внутри JSON, тело запроса на треть больше
+DATA_UPLOAD_MAX_MEMORY_SIZE = RECIPE_IMAGE_MAX_BYTES * 4 // 3 + 256 * 1024
+
+# Авторы с большим числом подписчиков не рассылают рецепты по лентам,
+# их рецепты подмешиваются в ленту при чтении
+FEED_FANOUT_LIMIT = int(os.getenv("FEED_FANOUT_LIMIT", 1000))
+
+# Кэш токенов: общий кэш (алиас из CACHES), время жизни записи и размер
+# LRU в каждом процессе. С общим кэшем (Redis, Memcached) запрос с
+# известным токеном не обращается к базе. Пустой алиас или кэш процесса
+# (LocMemCache, по умолчанию) отключают кэширование: отзыв токена не
+# дошел бы до других воркеров
+TOKEN_AUTH_CACHE = os.getenv("TOKEN_AUTH_CACHE", "api")
+TOKEN_AUTH_CACHE_TIMEOUT = int(os.getenv("TOKEN_AUTH_CACHE_TIMEOUT", 300))
+TOKEN_AUTH_CACHE_SIZE = int(os.getenv("TOKEN_AUTH_CACHE_SIZE", 10000))
+
+# Готовые представления рецептов без полей пользователя
+RECIPE_SNAPSHOTS = os.getenv("RECIPE_SNAPSHOTS", "True") == "True"
+RECIPE_SNAPSHOT_CACHE = "snapshots"
+RECIPE_SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+# Списки от API_JSON_STREAM_MIN_ITEMS элементов отдаются потоком,
+# JSON кодируется пачками по API_JSON_STREAM_CHUNK_SIZE элементов
+API_JSON_STREAM_MIN_ITEMS = 100
+API_JSON_STREAM_CHUNK_SIZE = 50
+
+API_PROFILING = os.getenv("API_PROFILING", "False") == "True"
+API_PROFILING_SLOW_MS = 500
+
+INGREDIENT_SEARCH_BACKEND = os.getenv(
+    "INGREDIENT_SEARCH_BACKEND", "recipes.autocomplete.InMemoryBackend"
+)
+INGREDIENT_SEARCH_LIMIT = 6
+INGREDIENT_SEARCH_MAX_LIMIT = 50
+# Индекс в памяти сверяет версию справочника с базой не чаще раза
+# в INGREDIENT_SEARCH_CHECK_INTERVAL секунд и живет не дольше
+# INGREDIENT_SEARCH_INDEX_TTL секунд
+INGREDIENT_SEARCH_CHECK_INTERVAL = 5
+INGREDIENT_SEARCH_INDEX_TTL = 5 * 60
+
+# Индекс подбора рецептов по ингредиентам: сверка версии рецептов
+# с базой и полная пересборка, секунды
+RECIPE_MATCHING_CHECK_INTERVAL = 5
+RECIPE_MATCHING_INDEX_TTL = 60 * 60
+
+SHOPPING_CART_EXPORT_CACHE_TTL = 60 * 60
+# Выгрузки от SHOPPING_CART_EXPORT_POOL_THRESHOLD строк рендерятся в пуле
+# из SHOPPING_CART_EXPORT_WORKERS процессов (0 - в потоке запроса), не
+# больше SHOPPING_CART_EXPORT_QUEUE_SIZE задач одновременно
+SHOPPING_CART_EXPORT_WORKERS = int(
+    os.getenv("SHOPPING_CART_EXPORT_WORKERS", 2)
+)
+SHOPPING_CART_EXPORT_POOL_THRESHOLD = 50
+SHOPPING_CART_EXPORT_QUEUE_SIZE = 8
+SHOPPING_CART_PDF_FONT = os.getenv(
+    "SHOPPING_CART_PDF_FONT",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from . import models
+from . import matching, models, search, services
 
 
 class IngredientInline(admin.TabularInline):
@@ -13,13 +13,23 @@ class IngredientInline(admin.TabularInline):
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ["name", "author", "get_favorite"]
     list_filter = ["author", "tags"]
+    list_select_related = ["author"]
     search_fields = ["name", "author__username", "tags__name"]
     inlines = [IngredientInline]
 
     def get_favorite(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     get_favorite.short_description = "В избранном"
+    get_favorite.admin_order_field = "favorites_count"
+
+    def save_related(self, request, form, formsets, change):
+        old_amounts = services.get_recipe_amounts(form.instance)
+        super().save_related(request, form, formsets, change)
+        if change:
+            services.update_carts_for_recipe(form.instance, old_amounts)
+        search.update_documents([form.instance.pk])
+        matching.mark_changed([form.instance.pk])
 
 
 @admin.register(models.Ingredient)
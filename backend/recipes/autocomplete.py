@@ -0,0 +1,148 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Max, Value, When
+from django.db.models.functions import Lower
+from django.utils.module_loading import import_string
+
+from .models import Ingredient
+
+
+def normalize(text):
+    return text.strip().lower()
+
+
+def get_version():
+    """Версия справочника по базе: число ингредиентов и последнее
+    изменение. Видна всем процессам, в том числе после load_ingredients."""
+    stats = Ingredient.objects.aggregate(
+        count=Count("pk"), modified=Max("updated_at")
+    )
+    return stats["count"], stats["modified"]
+
+
+class InMemoryBackend:
+    """Поиск ингредиентов по отсортированному индексу в памяти процесса.
+
+    Сначала отдаются совпадения по началу названия, затем по подстроке.
+    Индекс строится при первом запросе. Версия справочника сверяется с
+    базой не чаще раза в INGREDIENT_SEARCH_CHECK_INTERVAL секунд, а
+    старше INGREDIENT_SEARCH_INDEX_TTL индекс перестраивается в любом
+    случае. Изменения в текущем процессе сбрасывают индекс сразу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._version = None
+        self._loaded_at = 0
+        self._checked_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._items = None
+
+    def _is_fresh(self, now):
+        if self._keys is None:
+            return False
+        if now - self._loaded_at > settings.INGREDIENT_SEARCH_INDEX_TTL:
+            return False
+        if now - self._checked_at < settings.INGREDIENT_SEARCH_CHECK_INTERVAL:
+            return True
+        self._checked_at = now
+        return get_version() == self._version
+
+    def _load(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._is_fresh(now):
+                return self._keys, self._items
+
+            version = get_version()
+            ingredients = sorted(
+                Ingredient.objects.values("id", "name", "measurement_unit"),
+                key=lambda item: (normalize(item["name"]), item["id"]),
+            )
+            self._keys = [normalize(item["name"]) for item in ingredients]
+            self._items = ingredients
+            self._version = version
+            self._loaded_at = self._checked_at = now
+            return self._keys, self._items
+
+    def search(self, query, limit):
+        query = normalize(query)
+        keys, items = self._load()
+        if not query:
+            return items[:limit]
+
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:min(end, start + limit)]
+
+        if len(result) < limit:
+            for position, key in enumerate(keys):
+                if start <= position < end:
+                    continue
+                if query in key:
+                    result.append(items[position])
+                    if len(result) == limit:
+                        break
+        return result
+
+
+class TrigramBackend:
+    """Поиск средствами Postgres.
+
+    Выражение lower(name) покрыто GIN индексом с gin_trgm_ops,
+    поэтому LIKE по подстроке не сканирует всю таблицу.
+    """
+
+    def invalidate(self):
+        pass
+
+    def search(self, query, limit):
+        query = normalize(query)
+        queryset = Ingredient.objects.annotate(lower_name=Lower("name"))
+        if query:
+            queryset = queryset.filter(lower_name__contains=query).annotate(
+                rank=Case(
+                    When(lower_name__startswith=query, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                )
+            )
+        else:
+            queryset = queryset.annotate(rank=Value(0, IntegerField()))
+        return list(
+            queryset.order_by("rank", "lower_name", "id").values(
+                "id", "name", "measurement_unit"
+            )[:limit]
+        )
+
+
+_backends = {}
+
+
+def get_backend():
+    path = settings.INGREDIENT_SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def search(query, limit=None):
+    """Не больше INGREDIENT_SEARCH_MAX_LIMIT подсказок на запрос"""
+    if limit is None:
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+    limit = max(1, min(limit, settings.INGREDIENT_SEARCH_MAX_LIMIT))
+    return get_backend().search(query, limit)
+
+
+def invalidate():
+    get_backend().invalidate()
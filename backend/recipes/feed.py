@@ -0,0 +1,159 @@
+import heapq
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import FeedEntry, Recipe
+from users.models import Subscribe
+
+BATCH_SIZE = 1000
+
+FeedRow = namedtuple("FeedRow", ["create_date", "id"])
+
+
+def is_fanned_out(author):
+    return author.followers_count <= settings.FEED_FANOUT_LIMIT
+
+
+def publish(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков автора"""
+    if not is_fanned_out(recipe.author):
+        return
+    followers = Subscribe.objects.filter(author_id=recipe.author_id)
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe.pk,
+                author_id=recipe.author_id,
+                create_date=recipe.create_date,
+            )
+            for user_id in followers.values_list("subscriber_id", flat=True)
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def follow(user, *authors):
+    """Добавляет в ленту рецепты авторов, на которых подписался user"""
+    author_ids = [author.pk for author in authors if is_fanned_out(author)]
+    if not author_ids:
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user.pk,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                create_date=create_date,
+            )
+            for recipe_id, author_id, create_date in Recipe.objects.filter(
+                author_id__in=author_ids
+            ).values_list("id", "author_id", "create_date")
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def unfollow(user, *authors):
+    FeedEntry.objects.filter(user=user, author__in=authors).delete()
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Пересобирает ленты из подписок и рецептов"""
+    entries = FeedEntry.objects.all()
+    subscriptions = Subscribe.objects.filter(
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+    )
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(subscriber_id__in=user_ids)
+    entries.delete()
+
+    rows = (
+        subscriptions.order_by()
+        .values_list(
+            "subscriber_id",
+            "author_id",
+            "author__own_recipes__id",
+            "author__own_recipes__create_date",
+        )
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                author_id=author_id,
+                recipe_id=recipe_id,
+                create_date=create_date,
+            )
+            for user_id, author_id, recipe_id, create_date in rows
+            if recipe_id is not None
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Feed:
+    """Лента рецептов авторов, на которых подписан пользователь.
+
+    Рецепты обычных авторов читаются из записей ленты, рецепты авторов
+    с подписчиками больше FEED_FANOUT_LIMIT - напрямую из рецептов по
+    индексу (author, -create_date). Оба потока упорядочены по
+    (create_date, id) и сливаются при чтении.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def get_streams(self):
+        large_authors = list(
+            Subscribe.objects.filter(
+                subscriber=self.user,
+                author__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+            ).values_list("author_id", flat=True)
+        )
+        streams = [
+            (
+                FeedEntry.objects.filter(user=self.user).exclude(
+                    author_id__in=large_authors
+                ),
+                "recipe_id",
+            )
+        ]
+        if large_authors:
+            streams.append(
+                (Recipe.objects.filter(author_id__in=large_authors), "id")
+            )
+        return streams
+
+    def read(self, count, position=None, reverse=False):
+        """До count строк ленты после position: от новых к старым, а при
+        reverse - от старых к новым перед position"""
+        direction = "" if reverse else "-"
+        lookup = "gt" if reverse else "lt"
+        rows = []
+        for queryset, id_field in self.get_streams():
+            if position is not None:
+                create_date, recipe_id = position
+                queryset = queryset.filter(
+                    Q(**{f"create_date__{lookup}": create_date})
+                    | Q(
+                        create_date=create_date,
+                        **{f"{id_field}__{lookup}": recipe_id},
+                    )
+                )
+            rows.append(
+                FeedRow._make(row)
+                for row in queryset.order_by(
+                    f"{direction}create_date", f"{direction}{id_field}"
+                ).values_list("create_date", id_field)[:count]
+            )
+        return list(islice(heapq.merge(*rows, reverse=not reverse), count))
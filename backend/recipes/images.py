@@ -0,0 +1,113 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+from .models import Recipe
+
+logger = logging.getLogger("recipes.images")
+
+VARIANTS_DIR = "recipes/variants/"
+
+_executor = ThreadPoolExecutor(
+    max_workers=max(settings.RECIPE_IMAGE_WORKERS, 1),
+    thread_name_prefix="recipe-images",
+)
+
+
+def get_variant_format():
+    """WebP, если Pillow собран с libwebp, иначе JPEG"""
+    return ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+
+def needs_variants(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get("source") != recipe.image.name
+    )
+
+
+def render_variant(image, width, image_format):
+    height = max(round(image.height * width / image.width), 1)
+    variant = image.resize((width, height), Image.LANCZOS)
+    if image_format == "JPEG" and variant.mode != "RGB":
+        background = Image.new("RGB", variant.size, "white")
+        variant = variant.convert("RGBA")
+        background.paste(variant, mask=variant.getchannel("A"))
+        variant = background
+
+    buffer = io.BytesIO()
+    variant.save(buffer, image_format, quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(source, storage):
+    """Создает копии картинки нужных ширин. Имена строятся из хэша
+    содержимого, поэтому одинаковые картинки не пересчитываются."""
+    with storage.open(source) as stream:
+        content = stream.read()
+    digest = hashlib.sha256(content).hexdigest()
+    image_format, extension = get_variant_format()
+
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = (
+                "A" in image.getbands() or "transparency" in image.info
+            )
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        widths = {}
+        for width in sorted(settings.RECIPE_IMAGE_WIDTHS):
+            if width >= image.width:
+                break
+            name = f"{VARIANTS_DIR}{digest}-{width}.{extension}"
+            if not storage.exists(name):
+                name = storage.save(
+                    name,
+                    ContentFile(render_variant(image, width, image_format)),
+                )
+            widths[str(width)] = name
+    return widths
+
+
+def process_recipe_image(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not needs_variants(recipe):
+        return
+    source = recipe.image.name
+    widths = build_variants(source, recipe.image.storage)
+
+    with transaction.atomic():
+        recipe = (
+            Recipe.objects.select_for_update().filter(pk=recipe_id).first()
+        )
+        if recipe is None or recipe.image.name != source:
+            return
+        recipe.image_variants = {"source": source, "widths": widths}
+        recipe.save(update_fields=["image_variants", "updated_at"])
+
+
+def _run(recipe_id, in_worker=True):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception(
+            "Не удалось обработать картинку рецепта %s", recipe_id
+        )
+    finally:
+        if in_worker:
+            connections.close_all()
+
+
+def schedule(recipe_id):
+    """Отправляет рецепт в пул обработки. При RECIPE_IMAGE_WORKERS = 0
+    картинка обрабатывается сразу, в текущем потоке."""
+    if settings.RECIPE_IMAGE_WORKERS:
+        _executor.submit(_run, recipe_id)
+    else:
+        _run(recipe_id, in_worker=False)
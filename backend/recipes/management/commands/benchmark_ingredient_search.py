@@ -0,0 +1,46 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = "Замеряет задержку автодополнения ингредиентов на каждое нажатие"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend", default="recipes.autocomplete.InMemoryBackend"
+        )
+        parser.add_argument("--samples", type=int, default=200)
+        parser.add_argument("--limit", type=int, default=6)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list("name", flat=True))
+        if not names:
+            raise CommandError("Нет ингредиентов, загрузите их сначала")
+
+        random.seed(options["seed"])
+        words = random.choices(names, k=options["samples"])
+        backend = import_string(options["backend"])()
+        backend.search("", options["limit"])
+
+        timings = []
+        for word in words:
+            for length in range(1, len(word) + 1):
+                start = time.perf_counter()
+                backend.search(word[:length], options["limit"])
+                timings.append((time.perf_counter() - start) * 1_000_000)
+
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"{options['backend']}: {len(timings)} нажатий по "
+            f"{len(names)} ингредиентам, "
+            f"p50={statistics.median(timings):.0f} мкс, "
+            f"p99={p99:.0f} мкс, max={timings[-1]:.0f} мкс"
+        )
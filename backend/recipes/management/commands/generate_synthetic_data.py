@@ -0,0 +1,207 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes import feed, matching, models, search, services
+from users.models import Subscribe
+
+User = get_user_model()
+
+EMAIL_DOMAIN = "synthetic.local"
+TAGS = [
+    ("Завтрак", "#E26C2D", "breakfast"),
+    ("Обед", "#49B64E", "lunch"),
+    ("Ужин", "#8775D2", "dinner"),
+]
+
+
+def zipf_weights(size, exponent):
+    """Веса степенного распределения: первые элементы самые популярные"""
+    return [1 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+class Command(BaseCommand):
+    help = "Создает пользователей, рецепты и связи для бенчмарков"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--recipes", type=int, default=2000)
+        parser.add_argument("--subscriptions", type=int, default=20)
+        parser.add_argument("--favorites", type=int, default=30)
+        parser.add_argument("--cart", type=int, default=8)
+        parser.add_argument("--exponent", type=float, default=1.1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Удалить ранее созданные синтетические данные",
+        )
+
+    def handle(self, *args, **options):
+        synthetic_users = User.objects.filter(
+            email__endswith=f"@{EMAIL_DOMAIN}"
+        )
+        if options["clear"]:
+            deleted, _ = synthetic_users.delete()
+            self.stdout.write(f"Удалено объектов: {deleted}")
+            return
+        if synthetic_users.exists():
+            raise CommandError("Синтетические данные уже есть, см. --clear")
+
+        ingredient_ids = list(
+            models.Ingredient.objects.values_list("id", flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError("Сначала загрузите ингредиенты")
+
+        random.seed(options["seed"])
+        with transaction.atomic():
+            tags = self.create_tags()
+            users = self.create_users(options["users"])
+            recipes = self.create_recipes(
+                users, tags, ingredient_ids, options
+            )
+            self.create_relations(users, recipes, options)
+            services.rebuild_shopping_lists([user.id for user in users])
+            services.rebuild_counters()
+            search.rebuild()
+            feed.rebuild([user.id for user in users])
+            matching.invalidate()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Создано пользователей: {len(users)}, "
+                f"рецептов: {len(recipes)}"
+            )
+        )
+
+    def create_tags(self):
+        for name, color, slug in TAGS:
+            models.Tag.objects.get_or_create(
+                slug=slug, defaults={"name": name, "color": color}
+            )
+        return list(models.Tag.objects.all())
+
+    def create_users(self, count):
+        password = make_password("synthetic")
+        User.objects.bulk_create(
+            User(
+                email=f"user{number}@{EMAIL_DOMAIN}",
+                username=f"synthetic{number}",
+                first_name="Синтетический",
+                last_name=str(number),
+                password=password,
+            )
+            for number in range(count)
+        )
+        return list(
+            User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").order_by(
+                "id"
+            )
+        )
+
+    def create_recipes(self, users, tags, ingredient_ids, options):
+        author_weights = zipf_weights(len(users), options["exponent"])
+        authors = random.choices(
+            users, weights=author_weights, k=options["recipes"]
+        )
+        recipes = models.Recipe.objects.bulk_create(
+            models.Recipe(
+                author=author,
+                name=f"Рецепт {number}",
+                text="Синтетический рецепт для нагрузочного тестирования",
+                cooking_time=random.randint(5, 180),
+                image="recipes/synthetic.png",
+            )
+            for number, author in enumerate(authors)
+        )
+        if recipes and recipes[0].pk is None:
+            recipes = list(
+                models.Recipe.objects.filter(
+                    author__email__endswith=f"@{EMAIL_DOMAIN}"
+                )
+            )
+
+        tag_links = []
+        recipe_ingredients = []
+        ingredient_weights = zipf_weights(
+            len(ingredient_ids), options["exponent"]
+        )
+        for recipe in recipes:
+            for tag in random.sample(tags, random.randint(1, len(tags))):
+                tag_links.append(
+                    models.Recipe.tags.through(recipe=recipe, tag=tag)
+                )
+            size = min(
+                len(ingredient_ids), max(1, int(random.gauss(8, 3)))
+            )
+            chosen = set()
+            while len(chosen) < size:
+                chosen.update(
+                    random.choices(
+                        ingredient_ids,
+                        weights=ingredient_weights,
+                        k=size - len(chosen),
+                    )
+                )
+            recipe_ingredients.extend(
+                models.RecipeIngredients(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=random.randint(1, 500),
+                )
+                for ingredient_id in chosen
+            )
+
+        models.Recipe.tags.through.objects.bulk_create(tag_links)
+        models.RecipeIngredients.objects.bulk_create(
+            recipe_ingredients, batch_size=5000
+        )
+        return recipes
+
+    def create_relations(self, users, recipes, options):
+        author_weights = zipf_weights(len(users), options["exponent"])
+        recipe_weights = zipf_weights(len(recipes), options["exponent"])
+        subscriptions, favorites, carts = [], [], []
+
+        for user in users:
+            authors = {
+                author
+                for author in random.choices(
+                    users,
+                    weights=author_weights,
+                    k=random.randint(0, options["subscriptions"]),
+                )
+                if author != user
+            }
+            subscriptions.extend(
+                Subscribe(subscriber=user, author=author)
+                for author in authors
+            )
+            favorites.extend(
+                models.FavoriteRecipe(user=user, recipe=recipe)
+                for recipe in set(
+                    random.choices(
+                        recipes,
+                        weights=recipe_weights,
+                        k=random.randint(0, options["favorites"]),
+                    )
+                )
+            )
+            carts.extend(
+                models.ShoppingCart(user=user, recipe=recipe)
+                for recipe in set(
+                    random.choices(
+                        recipes,
+                        weights=recipe_weights,
+                        k=random.randint(0, options["cart"]),
+                    )
+                )
+            )
+
+        Subscribe.objects.bulk_create(subscriptions, batch_size=5000)
+        models.FavoriteRecipe.objects.bulk_create(favorites, batch_size=5000)
+        models.ShoppingCart.objects.bulk_create(carts, batch_size=5000)
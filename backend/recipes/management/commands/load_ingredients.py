@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes import autocomplete
+from recipes.models import Ingredient, Tag
+
+MODELS = {
+    "ingredients": (Ingredient, ["name", "measurement_unit"]),
+    "tags": (Tag, ["name", "color", "slug"]),
+}
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """Построчно отдает элементы JSON массива, не читая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        position = 0
+
+        if not started:
+            buffer = buffer.lstrip()
+            if not buffer:
+                if not chunk:
+                    return
+                continue
+            if buffer[0] != "[":
+                raise CommandError("Ожидается JSON массив")
+            position = 1
+            started = True
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+
+        buffer = buffer[position:]
+        if not chunk:
+            raise CommandError("Файл оборвался посреди JSON массива")
+
+
+def iter_csv(stream, fields):
+    for row in csv.reader(stream):
+        if row:
+            yield dict(zip(fields, row))
+
+
+class Command(BaseCommand):
+    help = "Загружает ингредиенты или теги из JSON/CSV файла"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=os.path.join(
+                settings.BASE_DIR, "..", "data", "ingredients.json"
+            ),
+        )
+        parser.add_argument(
+            "--model", choices=sorted(MODELS), default="ingredients"
+        )
+        parser.add_argument("--format", choices=["json", "csv"])
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        model, fields = MODELS[options["model"]]
+        path = options["path"]
+        file_format = options["format"] or os.path.splitext(path)[1][1:]
+        if file_format not in ("json", "csv"):
+            raise CommandError("Укажите --format json или csv")
+
+        with open(path, encoding="utf-8") as stream, transaction.atomic():
+            if file_format == "json":
+                rows = iter_json_array(stream)
+            else:
+                rows = iter_csv(stream, fields)
+            count_before = model.objects.count()
+            total = self.load(model, fields, rows, options["batch_size"])
+            created = model.objects.count() - count_before
+
+        if model is Ingredient:
+            autocomplete.invalidate()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Обработано {total}, добавлено {created}, "
+                f"пропущено {total - created}"
+            )
+        )
+
+    def load(self, model, fields, rows, batch_size):
+        start = time.perf_counter()
+        total = 0
+        batch = []
+
+        for row in rows:
+            try:
+                batch.append(model(**{field: row[field] for field in fields}))
+            except (KeyError, TypeError):
+                raise CommandError(f"Некорректная запись №{total + 1}: {row}")
+            total += 1
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+                self.report(total, start)
+
+        if batch:
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+        self.report(total, start)
+        return total
+
+    def report(self, total, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{total} записей за {elapsed:.2f} с "
+            f"({total / elapsed if elapsed else 0:.0f} записей/с)"
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Создает уменьшенные копии картинок рецептов, у которых их нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересобрать копии у всех рецептов",
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image="").only(
+            "id", "image", "image_variants"
+        )
+        processed = failed = 0
+        for recipe in recipes.iterator():
+            if options["all"]:
+                Recipe.objects.filter(pk=recipe.pk).update(image_variants={})
+            elif not images.needs_variants(recipe):
+                continue
+            try:
+                images.process_recipe_image(recipe.pk)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f"Рецепт {recipe.pk}: {error}")
+                continue
+            processed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Обработано рецептов: {processed}, с ошибками: {failed}"
+            )
+        )
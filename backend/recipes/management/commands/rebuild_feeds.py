@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from recipes import feed
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты подписок из Subscribe и Recipe"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids"
+        )
+
+    def handle(self, *args, **options):
+        feed.rebuild(options["user_ids"])
+        self.stdout.write(self.style.SUCCESS("Ленты пересобраны"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import services
+
+
+class Command(BaseCommand):
+    help = "Пересобирает или проверяет суммы в списках покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только сравнить таблицу с корзинами, ничего не меняя",
+        )
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids"
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["user_ids"]
+
+        if not options["verify"]:
+            services.rebuild_shopping_lists(user_ids)
+            self.stdout.write(self.style.SUCCESS("Списки покупок пересобраны"))
+            return
+
+        mismatches = services.diff_shopping_lists(user_ids)
+        for (user_id, ingredient_id), (expected, actual) in sorted(
+            mismatches.items()
+        ):
+            self.stdout.write(
+                f"user={user_id} ingredient={ingredient_id}: "
+                f"ожидается {expected}, в таблице {actual}"
+            )
+        if mismatches:
+            raise CommandError(f"Найдено расхождений: {len(mismatches)}")
+        self.stdout.write(self.style.SUCCESS("Расхождений нет"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import services
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет счетчики избранного, корзин, подписчиков и рецептов "
+        "с таблицами связей и исправляет расхождения"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только показать расхождения, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify"]:
+            updated = services.rebuild_counters()
+            self.stdout.write(
+                self.style.SUCCESS(f"Исправлено строк: {updated}")
+            )
+            return
+
+        mismatches = services.diff_counters()
+        for counter, rows in sorted(mismatches.items()):
+            for pk, expected, actual in rows:
+                self.stdout.write(
+                    f"{counter} pk={pk}: ожидается {expected}, "
+                    f"в таблице {actual}"
+                )
+        if mismatches:
+            total = sum(len(rows) for rows in mismatches.values())
+            raise CommandError(f"Найдено расхождений: {total}")
+        self.stdout.write(self.style.SUCCESS("Расхождений нет"))
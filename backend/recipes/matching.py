@@ -0,0 +1,304 @@
+import bisect
+import threading
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .models import Recipe, RecipeIngredients
+
+# Рецепты, измененные за это время до последнего известного изменения,
+# перечитываются повторно: транзакция могла закоммититься позже, чем
+# записала updated_at
+UPDATE_WINDOW = timedelta(minutes=1)
+
+
+def get_state():
+    """Версия рецептов по базе. id только растут, поэтому число и сумма
+    id меняются при любом добавлении или удалении, а updated_at - при
+    изменении рецепта или его ингредиентов."""
+    return Recipe.objects.aggregate(
+        count=Count("pk"),
+        id_sum=Sum("pk"),
+        max_id=Max("pk"),
+        modified=Max("updated_at"),
+    )
+
+
+def to_bitset(recipe_ids):
+    """Множество id как целое число: бит n выставлен для рецепта n"""
+    if not recipe_ids:
+        return 0
+    bits = bytearray(recipe_ids[-1] // 8 + 1)
+    for recipe_id in recipe_ids:
+        bits[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(bits, "little")
+
+
+def popcount(bitset):
+    if hasattr(bitset, "bit_count"):
+        return bitset.bit_count()
+    return bin(bitset).count("1")
+
+
+class MatchResult:
+    """Рецепты, ранжированные по покрытию: доля ингредиентов рецепта,
+    которые есть у пользователя.
+
+    Рецепты разбиты на группы с одинаковыми (совпало, всего) и внутри
+    группы идут от новых к старым. Срез достает из битовых множеств
+    только нужные id, поэтому результат можно отдавать пагинатору как
+    список.
+    """
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            union = 0
+            for _, _, bitset in self._buckets:
+                union |= bitset
+            self._count = popcount(union)
+        return self._count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(len(self))
+        result = []
+        position = 0
+        for matched, size, bitset in self._buckets:
+            if position >= stop:
+                break
+            if position < start:
+                count = popcount(bitset)
+                if position + count <= start:
+                    position += count
+                    continue
+            while bitset and position < stop:
+                recipe_id = bitset.bit_length() - 1
+                bitset ^= 1 << recipe_id
+                if position >= start:
+                    result.append((recipe_id, matched, size))
+                position += 1
+        return result
+
+
+class IngredientIndex:
+    """Обратный индекс ингредиент -> отсортированный массив id рецептов.
+
+    Для частых ингредиентов массив дополнительно хранится битовым
+    множеством, а рецепты разложены по числу ингредиентов. Запрос
+    складывает множества побитовым сумматором и не перебирает рецепты
+    по одному.
+
+    Индекс строится при первом запросе. Версия рецептов сверяется с
+    базой не чаще раза в RECIPE_MATCHING_CHECK_INTERVAL секунд: новые и
+    измененные рецепты перечитываются точечно, после удаления в другом
+    процессе индекс пересобирается. Старше RECIPE_MATCHING_INDEX_TTL
+    индекс пересобирается в любом случае. Изменения текущего процесса
+    применяются при следующем запросе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._recipes = None
+        self._bitsets = {}
+        self._sizes = {}
+        self._max_id = 0
+        self._state = None
+        self._pending = set()
+        self._loaded_at = 0
+        self._checked_at = 0
+
+    def _rebuild(self, state, now):
+        postings = {}
+        recipes = {}
+        rows = (
+            RecipeIngredients.objects.order_by("recipe_id", "ingredient_id")
+            .values_list("recipe_id", "ingredient_id")
+            .iterator(chunk_size=10000)
+        )
+        for recipe_id, ingredient_id in rows:
+            postings.setdefault(ingredient_id, array("I")).append(recipe_id)
+            recipes.setdefault(recipe_id, array("I")).append(ingredient_id)
+
+        by_size = {}
+        for recipe_id, ingredient_ids in recipes.items():
+            by_size.setdefault(len(ingredient_ids), []).append(recipe_id)
+
+        self._postings = postings
+        self._recipes = recipes
+        self._bitsets = {}
+        self._sizes = {
+            size: to_bitset(sorted(recipe_ids))
+            for size, recipe_ids in by_size.items()
+        }
+        self._max_id = max(recipes, default=0)
+        self._state = state
+        self._pending = set()
+        self._loaded_at = self._checked_at = now
+
+    def _set_size(self, recipe_id, size, present):
+        bitset = self._sizes.get(size, 0)
+        if present:
+            bitset |= 1 << recipe_id
+        else:
+            bitset &= ~(1 << recipe_id)
+        if bitset:
+            self._sizes[size] = bitset
+        else:
+            self._sizes.pop(size, None)
+
+    def _reload(self, recipe_ids):
+        for recipe_id in recipe_ids:
+            ingredient_ids = self._recipes.pop(recipe_id, ())
+            if ingredient_ids:
+                self._set_size(recipe_id, len(ingredient_ids), False)
+            for ingredient_id in ingredient_ids:
+                posting = self._postings[ingredient_id]
+                del posting[bisect.bisect_left(posting, recipe_id)]
+                self._bitsets.pop(ingredient_id, None)
+
+        rows = (
+            RecipeIngredients.objects.filter(recipe_id__in=recipe_ids)
+            .order_by("recipe_id", "ingredient_id")
+            .values_list("recipe_id", "ingredient_id")
+        )
+        for recipe_id, ingredient_id in rows:
+            posting = self._postings.setdefault(ingredient_id, array("I"))
+            posting.insert(bisect.bisect_left(posting, recipe_id), recipe_id)
+            self._bitsets.pop(ingredient_id, None)
+            self._recipes.setdefault(recipe_id, array("I")).append(
+                ingredient_id
+            )
+            self._max_id = max(self._max_id, recipe_id)
+
+        for recipe_id in recipe_ids:
+            if recipe_id in self._recipes:
+                self._set_size(recipe_id, len(self._recipes[recipe_id]), True)
+
+    def _sync(self):
+        now = time.monotonic()
+        if (
+            self._postings is None
+            or now - self._loaded_at > settings.RECIPE_MATCHING_INDEX_TTL
+        ):
+            self._rebuild(get_state(), now)
+            return
+        interval = settings.RECIPE_MATCHING_CHECK_INTERVAL
+        if not self._pending and now - self._checked_at < interval:
+            return
+
+        self._checked_at = now
+        state = get_state()
+        changed, self._pending = self._pending, set()
+        if state == self._state and not changed:
+            return
+
+        known = self._state
+        # Удаленные в этом процессе рецепты известны, остальные удаления
+        # видны по расхождению числа и суммы id
+        existing = set(
+            Recipe.objects.filter(pk__in=changed).values_list("pk", flat=True)
+        )
+        removed = [pk for pk in changed - existing if pk in self._recipes]
+        created = list(
+            Recipe.objects.filter(pk__gt=known["max_id"] or 0).values_list(
+                "pk", flat=True
+            )
+        )
+        expected = (
+            known["count"] - len(removed) + len(created),
+            (known["id_sum"] or 0) - sum(removed) + sum(created),
+        )
+        if expected != (state["count"], state["id_sum"] or 0):
+            self._rebuild(state, now)
+            return
+
+        changed.update(created)
+        if known["modified"] is not None and state["modified"] is not None:
+            changed.update(
+                Recipe.objects.filter(
+                    updated_at__gte=known["modified"] - UPDATE_WINDOW
+                ).values_list("pk", flat=True)
+            )
+        if changed:
+            self._reload(changed)
+        self._state = state
+
+    def _bitset(self, ingredient_id):
+        """Битовое множество рецептов с ингредиентом. Кэшируется, только
+        если оно не больше массива id, то есть для частых ингредиентов."""
+        bitset = self._bitsets.get(ingredient_id)
+        if bitset is not None:
+            return bitset
+        posting = self._postings.get(ingredient_id, ())
+        bitset = to_bitset(posting)
+        if len(posting) * 32 >= self._max_id:
+            self._bitsets[ingredient_id] = bitset
+        return bitset
+
+    def mark_changed(self, recipe_ids):
+        with self._lock:
+            self._pending.update(recipe_ids)
+
+    def invalidate(self):
+        with self._lock:
+            self._postings = None
+
+    def match(self, ingredient_ids, min_coverage=0):
+        with self._lock:
+            self._sync()
+            # planes[j] - рецепты, у которых бит j числа совпадений равен 1
+            planes = []
+            for ingredient_id in set(ingredient_ids):
+                carry = self._bitset(ingredient_id)
+                for position, plane in enumerate(planes):
+                    if not carry:
+                        break
+                    planes[position] = plane ^ carry
+                    carry &= plane
+                if carry:
+                    planes.append(carry)
+            sizes = dict(self._sizes)
+
+        buckets = []
+        for matched in range(1, 2 ** len(planes)):
+            exact = -1
+            for position, plane in enumerate(planes):
+                exact &= plane if matched >> position & 1 else ~plane
+            if not exact:
+                continue
+            for size, recipes in sizes.items():
+                if size < matched or matched / size < min_coverage:
+                    continue
+                bitset = exact & recipes
+                if bitset:
+                    buckets.append((matched, size, bitset))
+        buckets.sort(key=lambda bucket: (bucket[0] / bucket[1], bucket[0]))
+        buckets.reverse()
+        return MatchResult(buckets)
+
+
+index = IngredientIndex()
+
+
+def match(ingredient_ids, min_coverage=0):
+    return index.match(ingredient_ids, min_coverage)
+
+
+def mark_changed(recipe_ids):
+    """Обновляет рецепты в индексе после коммита транзакции"""
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: index.mark_changed(recipe_ids))
+
+
+def invalidate():
+    transaction.on_commit(index.invalidate)
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_list(apps, schema_editor):
+    ShoppingCart = apps.get_model("recipes", "ShoppingCart")
+    ShoppingListItem = apps.get_model("recipes", "ShoppingListItem")
+    rows = (
+        ShoppingCart.objects.values("user_id")
+        .annotate(
+            ingredient_id=models.F("recipe__ingredientsamount__ingredient_id"),
+            total_amount=models.Sum("recipe__ingredientsamount__amount"),
+        )
+        .filter(ingredient_id__isnull=False)
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(**row) for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_list, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_ingredient_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-create_date'], name='recipe_author_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-create_date', '-id'], name='recipe_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:33
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count(related_model, related_field):
+    return Coalesce(
+        models.Subquery(
+            related_model.objects.filter(
+                **{related_field: models.OuterRef("pk")}
+            )
+            .order_by()
+            .values(related_field)
+            .annotate(count=models.Count("pk"))
+            .values("count"),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Recipe.objects.update(
+        favorites_count=count(
+            apps.get_model("recipes", "FavoriteRecipe"), "recipe"
+        ),
+        in_carts_count=count(
+            apps.get_model("recipes", "ShoppingCart"), "recipe"
+        ),
+    )
+    User.objects.update(
+        followers_count=count(apps.get_model("users", "Subscribe"), "author"),
+        recipes_count=count(Recipe, "author"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_variants'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-create_date', '-id'], name='recipe_favorites_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-in_carts_count', '-create_date', '-id'], name='recipe_in_carts_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
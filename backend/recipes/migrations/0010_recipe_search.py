@@ -0,0 +1,82 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:35
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(search_ingredients, '')), "
+    "'B') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'C')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX recipes_recipe_search_vector "
+            "ON recipes_recipe USING gin (search_vector)"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE recipes_recipe_fts "
+            "USING fts5(name, ingredients, text)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS recipes_recipe_fts")
+
+
+def fill_search_documents(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    RecipeIngredients = apps.get_model("recipes", "RecipeIngredients")
+    names = defaultdict(list)
+    for recipe_id, name in RecipeIngredients.objects.order_by(
+        "ingredient__name"
+    ).values_list("recipe_id", "ingredient__name"):
+        names[recipe_id].append(name)
+
+    recipes = list(Recipe.objects.only("id", "name", "text"))
+    for recipe in recipes:
+        recipe.search_ingredients = " ".join(names[recipe.pk])
+    Recipe.objects.bulk_update(
+        recipes, ["search_ingredients"], batch_size=500
+    )
+
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(
+            "INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) "
+            "SELECT id, REPLACE(REPLACE(name, 'ё', 'е'), 'Ё', 'Е'), "
+            "REPLACE(REPLACE(search_ingredients, 'ё', 'е'), 'Ё', 'Е'), "
+            "REPLACE(REPLACE(text, 'ё', 'е'), 'Ё', 'Е') FROM recipes_recipe"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_ingredients',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Ингредиенты для поиска'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from users.models import Subscribe
+
 User = get_user_model()
 
 
@@ -9,6 +11,7 @@ class Tag(models.Model):
     name = models.CharField("Название", max_length=30)
     color = models.CharField("Цвет", max_length=7)
     slug = models.SlugField("Слаг", unique=True, max_length=30)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
 
     class Meta:
         verbose_name = "Тег"
@@ -22,6 +25,7 @@ class Tag(models.Model):
 class Ingredient(models.Model):
     name = models.CharField("Название", max_length=30)
     measurement_unit = models.CharField("Ед. измерения", max_length=10)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
 
     class Meta:
         constraints = [
@@ -38,12 +42,65 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_relations(self, author=True, tags=True, ingredients=True):
+        """Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов. Ненужные связи можно отключить."""
+        queryset = self
+        if author:
+            queryset = queryset.select_related("author")
+        if tags:
+            queryset = queryset.prefetch_related("tags")
+        if not ingredients:
+            return queryset
+        return queryset.prefetch_related(
+            models.Prefetch(
+                "ingredientsamount",
+                queryset=RecipeIngredients.objects.select_related(
+                    "ingredient"
+                ),
+            )
+        )
+
+    def with_user_flags(
+        self, user, favorited=True, in_cart=True, subscribed=True
+    ):
+        """Добавляет признаки избранного, корзины и подписки на автора
+        для текущего пользователя."""
+        if user.is_anonymous:
+            return self
+
+        flags = {}
+        if favorited:
+            flags["is_favorited"] = models.Exists(
+                FavoriteRecipe.objects.filter(
+                    recipe=models.OuterRef("pk"), user=user
+                )
+            )
+        if in_cart:
+            flags["is_in_shopping_cart"] = models.Exists(
+                ShoppingCart.objects.filter(
+                    recipe=models.OuterRef("pk"), user=user
+                )
+            )
+        if subscribed:
+            flags["author_is_subscribed"] = models.Exists(
+                Subscribe.objects.filter(
+                    author=models.OuterRef("author"), subscriber=user
+                )
+            )
+        return self.annotate(**flags)
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="own_recipes"
     )
     name = models.CharField("Название", max_length=50)
     image = models.ImageField(upload_to="recipes/")
+    image_variants = models.JSONField(
+        "Уменьшенные копии картинки", default=dict, blank=True, editable=False
+    )
     text = models.TextField("Описание", max_length=200)
     ingredients = models.ManyToManyField(
         Ingredient, through="RecipeIngredients", related_name="recipes"
@@ -55,11 +112,40 @@ class Recipe(models.Model):
     create_date = models.DateTimeField(
         "Дата добавления", auto_now_add=True, blank=True
     )
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
     favorite = models.ManyToManyField(
         User, through="FavoriteRecipe", related_name="recipes"
     )
+    favorites_count = models.PositiveIntegerField(
+        "В избранном", default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        "В списках покупок", default=0, editable=False
+    )
+    search_ingredients = models.TextField(
+        "Ингредиенты для поиска", blank=True, default="", editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=["author", "-create_date"],
+                name="recipe_author_date_idx",
+            ),
+            models.Index(
+                fields=["-create_date", "-id"], name="recipe_date_id_idx"
+            ),
+            models.Index(
+                fields=["-favorites_count", "-create_date", "-id"],
+                name="recipe_favorites_idx",
+            ),
+            models.Index(
+                fields=["-in_carts_count", "-create_date", "-id"],
+                name="recipe_in_carts_idx",
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-create_date"]
@@ -139,3 +225,65 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f"Продукты из {self.recipe} в корзине у {self.user}"
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента в списке покупок пользователя"""
+
+    user = models.ForeignKey(
+        User, related_name="shopping_list", on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, related_name="shopping_list", on_delete=models.CASCADE
+    )
+    total_amount = models.IntegerField("Количество")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item",
+            )
+        ]
+        verbose_name = "Ингредиент в списке покупок"
+        verbose_name_plural = "Ингредиенты в списке покупок"
+
+    def __str__(self):
+        return f"{self.ingredient} - {self.total_amount} у {self.user}"
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, записывается при публикации"""
+
+    user = models.ForeignKey(
+        User, related_name="feed", on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        Recipe, related_name="feed_entries", on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User, related_name="+", on_delete=models.CASCADE
+    )
+    create_date = models.DateTimeField("Дата добавления рецепта")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_feed_entry",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-create_date", "-recipe"],
+                name="feed_user_date_idx",
+            ),
+            models.Index(
+                fields=["user", "author"], name="feed_user_author_idx"
+            ),
+        ]
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+
+    def __str__(self):
+        return f"{self.recipe} в ленте {self.user}"
@@ -0,0 +1,188 @@
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorField,
+)
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe, RecipeIngredients
+
+WORD = re.compile(r"\w+")
+ENDINGS = "аеёиоуыэюяйь"
+BATCH_SIZE = 500
+
+
+class PostgresBackend:
+    """Полнотекстовый поиск Postgres.
+
+    Документ хранится в сгенерированной колонке search_vector с GIN
+    индексом: название с весом A, ингредиенты B, описание C, русская
+    морфология. База пересчитывает колонку сама при изменении строки.
+    """
+
+    def index(self, recipes):
+        pass
+
+    def remove(self, recipe_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(
+            query, config="russian", search_type="websearch"
+        )
+        vector = RawSQL(
+            f'"{Recipe._meta.db_table}"."search_vector"',
+            [],
+            output_field=SearchVectorField(),
+        )
+        return (
+            queryset.alias(search_vector=vector)
+            .filter(search_vector=search_query)
+            .annotate(search_rank=SearchRank(vector, search_query))
+        )
+
+
+class SQLiteBackend:
+    """Поиск по таблице FTS5 для локальной разработки.
+
+    Стеммера для русского в SQLite нет, поэтому у слов запроса
+    отрезаются окончания и они ищутся как префиксы, а ё заменяется на е
+    и в документах, и в запросе.
+    """
+
+    table = "recipes_recipe_fts"
+    weights = (10.0, 5.0, 1.0)
+
+    def index(self, recipes):
+        recipes = list(recipes)
+        self.remove([recipe.pk for recipe in recipes])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} "
+                "(rowid, name, ingredients, text) VALUES (%s, %s, %s, %s)",
+                [
+                    (
+                        recipe.pk,
+                        self.normalize(recipe.name),
+                        self.normalize(recipe.search_ingredients),
+                        self.normalize(recipe.text),
+                    )
+                    for recipe in recipes
+                ],
+            )
+
+    def remove(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"({', '.join(['%s'] * len(recipe_ids))})",
+                recipe_ids,
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    @staticmethod
+    def normalize(text):
+        return text.replace("ё", "е").replace("Ё", "Е")
+
+    @staticmethod
+    def stem(word):
+        stripped = word
+        while (
+            stripped[-1:] in ENDINGS
+            and len(stripped) > 3
+            and len(word) - len(stripped) < 2
+        ):
+            stripped = stripped[:-1]
+        return stripped
+
+    def to_match(self, query):
+        return " ".join(
+            f'"{self.stem(word)}"*'
+            for word in WORD.findall(self.normalize(query.lower()))
+        )
+
+    def search(self, queryset, query):
+        match = self.to_match(query)
+        if not match:
+            return queryset.none()
+
+        weights = ", ".join(map(str, self.weights))
+        rank = RawSQL(
+            f"SELECT -bm25({self.table}, {weights}) FROM {self.table} "
+            f"WHERE {self.table} MATCH %s "
+            f'AND rowid = "{Recipe._meta.db_table}"."id"',
+            [match],
+        )
+        matched = RawSQL(
+            f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s",
+            [match],
+        )
+        return queryset.filter(pk__in=matched).annotate(search_rank=rank)
+
+
+BACKENDS = {"postgresql": PostgresBackend, "sqlite": SQLiteBackend}
+
+_backends = {}
+
+
+def get_backend():
+    vendor = connection.vendor
+    if vendor not in _backends:
+        _backends[vendor] = BACKENDS[vendor]()
+    return _backends[vendor]
+
+
+def search(queryset, query):
+    """Рецепты, подходящие под запрос, с релевантностью search_rank"""
+    return get_backend().search(queryset, query)
+
+
+def update_documents(recipe_ids):
+    """Пересобирает список ингредиентов в документе рецептов и
+    обновляет их в поисковом индексе"""
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        names = defaultdict(list)
+        for recipe_id, name in (
+            RecipeIngredients.objects.filter(recipe_id__in=batch)
+            .order_by("ingredient__name")
+            .values_list("recipe_id", "ingredient__name")
+        ):
+            names[recipe_id].append(name)
+
+        recipes = list(
+            Recipe.objects.filter(pk__in=batch).only(
+                "id", "name", "text", "search_ingredients"
+            )
+        )
+        changed = []
+        for recipe in recipes:
+            document = " ".join(names[recipe.pk])
+            if recipe.search_ingredients != document:
+                recipe.search_ingredients = document
+                changed.append(recipe)
+        Recipe.objects.bulk_update(changed, ["search_ingredients"])
+        get_backend().index(recipes)
+
+
+def remove_documents(recipe_ids):
+    get_backend().remove(recipe_ids)
+
+
+def rebuild():
+    get_backend().clear()
+    update_documents(Recipe.objects.values_list("pk", flat=True))
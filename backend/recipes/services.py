@@ -0,0 +1,269 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (
+    FavoriteRecipe,
+    Recipe,
+    RecipeIngredients,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from users.models import Subscribe
+
+User = get_user_model()
+
+# Денормализованные счетчики: (модель, поле, модель связи, поле связи)
+COUNTERS = [
+    (Recipe, "favorites_count", FavoriteRecipe, "recipe"),
+    (Recipe, "in_carts_count", ShoppingCart, "recipe"),
+    (User, "followers_count", Subscribe, "author"),
+    (User, "recipes_count", Recipe, "author"),
+]
+
+
+def get_recipe_amounts(recipe):
+    """Словарь {id ингредиента: количество} для рецепта"""
+    return dict(
+        RecipeIngredients.objects.filter(recipe=recipe).values_list(
+            "ingredient_id", "amount"
+        )
+    )
+
+
+def get_recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов в рецептах recipe_ids"""
+    return dict(
+        RecipeIngredients.objects.filter(recipe_id__in=recipe_ids)
+        .order_by()
+        .values("ingredient_id")
+        .annotate(total=Sum("amount"))
+        .values_list("ingredient_id", "total")
+    )
+
+
+def get_amounts_delta(old_amounts, new_amounts):
+    """Разница между старым и новым составом рецепта"""
+    delta = defaultdict(int)
+    for ingredient_id, amount in new_amounts.items():
+        delta[ingredient_id] += amount
+    for ingredient_id, amount in old_amounts.items():
+        delta[ingredient_id] -= amount
+    return {key: value for key, value in delta.items() if value}
+
+
+def apply_shopping_list_delta(user_ids, delta):
+    """Прибавляет delta к спискам покупок пользователей user_ids"""
+    user_ids = list(user_ids)
+    if not user_ids or not delta:
+        return
+
+    with transaction.atomic():
+        # Без блокировки два параллельных добавления в корзину не видят
+        # строк друг друга и оба вставляют одну позицию списка
+        lock_users(user_ids)
+        items = ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=delta
+        )
+        existing = set(items.values_list("user_id", "ingredient_id"))
+
+        items.update(
+            total_amount=F("total_amount")
+            + Case(
+                *[
+                    When(ingredient_id=ingredient_id, then=Value(amount))
+                    for ingredient_id, amount in delta.items()
+                ],
+                output_field=IntegerField(),
+            )
+        )
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=amount,
+            )
+            for user_id in user_ids
+            for ingredient_id, amount in delta.items()
+            if amount > 0 and (user_id, ingredient_id) not in existing
+        )
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids, total_amount__lte=0
+        ).delete()
+
+
+def add_recipe_to_shopping_list(user, recipe):
+    apply_shopping_list_delta([user.id], get_recipe_amounts(recipe))
+
+
+def remove_recipe_from_shopping_list(user, recipe):
+    delta = get_amounts_delta(get_recipe_amounts(recipe), {})
+    apply_shopping_list_delta([user.id], delta)
+
+
+def remove_recipe_from_carts(recipe):
+    """Вычитает рецепт из списков покупок всех, у кого он в корзине"""
+    apply_shopping_list_delta(
+        get_cart_user_ids(recipe),
+        get_amounts_delta(get_recipe_amounts(recipe), {}),
+    )
+
+
+def update_carts_for_recipe(recipe, old_amounts):
+    """Переносит изменение состава рецепта в списки покупок"""
+    apply_shopping_list_delta(
+        get_cart_user_ids(recipe),
+        get_amounts_delta(old_amounts, get_recipe_amounts(recipe)),
+    )
+
+
+def lock_user(user):
+    """Блокирует строку пользователя до конца транзакции, чтобы его
+    избранное, корзина и подписки менялись последовательно"""
+    lock_users([user.pk])
+
+
+def lock_users(user_ids):
+    """Блокирует строки пользователей в порядке id, чтобы параллельные
+    транзакции не ждали друг друга по кругу"""
+    list(
+        User.objects.select_for_update()
+        .filter(pk__in=user_ids)
+        .order_by("pk")
+        .values("pk")
+    )
+
+
+def get_cart_user_ids(recipe):
+    return ShoppingCart.objects.filter(recipe=recipe).values_list(
+        "user_id", flat=True
+    )
+
+
+def aggregate_shopping_carts(user_ids=None):
+    """Суммы ингредиентов, посчитанные напрямую по корзинам"""
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    return (
+        carts.values("user_id")
+        .annotate(
+            ingredient_id=F("recipe__ingredientsamount__ingredient_id"),
+            total_amount=Sum("recipe__ingredientsamount__amount"),
+        )
+        .filter(ingredient_id__isnull=False)
+        .order_by()
+    )
+
+
+def diff_shopping_lists(user_ids=None):
+    """Расхождения таблицы ShoppingListItem с корзинами.
+
+    Возвращает словарь {(user_id, ingredient_id): (ожидаемое, текущее)}.
+    """
+    expected = {
+        (row["user_id"], row["ingredient_id"]): row["total_amount"]
+        for row in aggregate_shopping_carts(user_ids)
+    }
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    actual = {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in items.values_list(
+            "user_id", "ingredient_id", "total_amount"
+        )
+    }
+    return {
+        key: (expected.get(key), actual.get(key))
+        for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    }
+
+
+def rebuild_shopping_lists(user_ids=None, batch_size=1000):
+    """Пересобирает ShoppingListItem из корзин с нуля"""
+    with transaction.atomic():
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        items.delete()
+        ShoppingListItem.objects.bulk_create(
+            (
+                ShoppingListItem(**row)
+                for row in aggregate_shopping_carts(user_ids).iterator()
+            ),
+            batch_size=batch_size,
+        )
+
+
+def change_counter(queryset, field, delta):
+    """Атомарно меняет счетчик у строк queryset, не опуская его ниже нуля"""
+    if not delta:
+        return
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    queryset.update(**{field: value})
+
+
+def count_related(related_model, related_field):
+    """Подзапрос с настоящим числом связанных строк"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{related_field: OuterRef("pk")})
+            .order_by()
+            .values(related_field)
+            .annotate(count=Count("pk"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def get_counter_drift(model, field, related_model, related_field):
+    return model.objects.annotate(
+        expected=count_related(related_model, related_field)
+    ).exclude(**{field: F("expected")})
+
+
+def diff_counters():
+    """Расхождения счетчиков с таблицами связей.
+
+    Возвращает словарь {"модель.поле": [(pk, ожидаемое, текущее)]}.
+    """
+    mismatches = {}
+    for model, field, related_model, related_field in COUNTERS:
+        rows = list(
+            get_counter_drift(
+                model, field, related_model, related_field
+            ).values_list("pk", "expected", field)
+        )
+        if rows:
+            mismatches[f"{model._meta.label}.{field}"] = rows
+    return mismatches
+
+
+def rebuild_counters():
+    """Пересчитывает разошедшиеся счетчики, возвращает число строк"""
+    updated = 0
+    with transaction.atomic():
+        for model, field, related_model, related_field in COUNTERS:
+            updated += get_counter_drift(
+                model, field, related_model, related_field
+            ).update(**{field: count_related(related_model, related_field)})
+    return updated
@@ -0,0 +1,116 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import autocomplete, feed, images, matching, search, services
+from .models import Ingredient, Recipe, RecipeIngredients, Tag
+
+User = get_user_model()
+
+
+def touch_recipes(**lookup):
+    """Обновляет updated_at рецептов, чье представление изменилось"""
+    Recipe.objects.filter(**lookup).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    autocomplete.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_matching_index(sender, **kwargs):
+    matching.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(ingredients=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    if not created:
+        search.update_documents(
+            Recipe.objects.filter(ingredients=instance).values_list(
+                "pk", flat=True
+            )
+        )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(tags=instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if images.needs_variants(instance):
+        recipe_id = instance.pk
+        transaction.on_commit(lambda: images.schedule(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        services.change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", 1
+        )
+        feed.publish(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    services.change_counter(
+        User.objects.filter(pk=instance.author_id), "recipes_count", -1
+    )
+    search.remove_documents([instance.pk])
+    matching.mark_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_removed_from_carts(sender, instance, **kwargs):
+    """Удаление рецепта любым путем - API, админка, ORM или каскад от
+    автора - вычитает его из списков покупок"""
+    services.remove_recipe_from_carts(instance)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredients)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    touch_recipes(pk=instance.recipe_id)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields and set(update_fields) <= {"last_login", "password"}:
+        return
+    touch_recipes(author=instance)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Избранное, корзины и подписки пользователя удалятся каскадом,
+    минуя viewsets, поэтому счетчики уменьшаются здесь"""
+    services.change_counter(
+        Recipe.objects.filter(favorite_recipes__user=instance),
+        "favorites_count",
+        -1,
+    )
+    services.change_counter(
+        Recipe.objects.filter(shopping_cart__user=instance),
+        "in_carts_count",
+        -1,
+    )
+    services.change_counter(
+        User.objects.filter(authors__subscriber=instance),
+        "followers_count",
+        -1,
+    )
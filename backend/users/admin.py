@@ -8,7 +8,7 @@ User = get_user_model()
 
 @admin.register(User)
 class UsersAdmin(admin.ModelAdmin):
-    list_display = ["username", "email"]
+    list_display = ["username", "email", "followers_count", "recipes_count"]
     search_fields = ["username", "email"]
 
 
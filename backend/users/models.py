@@ -7,6 +7,12 @@ class User(AbstractUser):
     email = models.EmailField(max_length=254, unique=True)
     first_name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=150)
+    followers_count = models.PositiveIntegerField(
+        "Подписчиков", default=0, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        "Рецептов", default=0, editable=False
+    )
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name"]
 
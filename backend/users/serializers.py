@@ -25,4 +25,8 @@ class UserSerializer(BaseUserSerializer):
         if user.is_anonymous:
             return False
 
+        is_subscribed = getattr(obj, "is_subscribed", None)
+        if is_subscribed is not None:
+            return is_subscribed
+
         return user.subscribers.filter(author=obj).exists()